@@ -18,3 +18,9 @@ limit = click.option(
     help="Limit the number of messages to transfer.",
     default=None,
 )
+incremental = click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only query ODC datasets indexed since the last incremental report",
+)
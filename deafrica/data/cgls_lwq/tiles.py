@@ -9,12 +9,13 @@ from odc.geo import CRS, XY, Resolution
 from odc.geo.geom import Geometry
 from odc.geo.gridspec import GridSpec
 
-from deafrica.utils import AFRICA_EXTENT_URL
+from deafrica.utils import AFRICA_EXTENT_URL, get_derived_reference
 
 
 def get_africa_tiles(grid_res: int | float) -> list:
     """
-    Get tiles over Africa extent.
+    Get tiles over Africa extent. The tiles are cached for each grid
+    resolution and only computed again when the Africa extent changes.
 
     Parameters
     ----------
@@ -37,12 +38,19 @@ def get_africa_tiles(grid_res: int | float) -> list:
         origin=XY(y=-7392000, x=-17376000),
     )
 
-    # Get the tiles over Africa
-    africa_extent = gpd.read_file(AFRICA_EXTENT_URL).to_crs(gridspec.crs)
-    africa_extent_geom = Geometry(
-        geom=africa_extent.iloc[0].geometry, crs=africa_extent.crs
+    def build_tiles(africa_extent_path: str) -> list:
+        # Get the tiles over Africa
+        africa_extent = gpd.read_file(africa_extent_path).to_crs(gridspec.crs)
+        africa_extent_geom = Geometry(
+            geom=africa_extent.iloc[0].geometry, crs=africa_extent.crs
+        )
+        return list(gridspec.tiles_from_geopolygon(africa_extent_geom))
+
+    tiles = get_derived_reference(
+        name=f"cgls_lwq_africa_tiles_{grid_res}",
+        urls=[AFRICA_EXTENT_URL],
+        build=build_tiles,
     )
-    tiles = list(gridspec.tiles_from_geopolygon(africa_extent_geom))
 
     return tiles
 
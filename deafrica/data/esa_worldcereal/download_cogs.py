@@ -32,7 +32,7 @@ from deafrica.io import (
     join_url,
 )
 from deafrica.logs import setup_logging
-from deafrica.utils import AFRICA_EXTENT_URL
+from deafrica.utils import AFRICA_EXTENT_URL, get_reference_file
 
 log = setup_logging()
 
@@ -45,9 +45,13 @@ def get_africa_aez_ids():
         set[str]: Agro-ecological zone (AEZ) ids for the zones in Africa
     """
     # Get the AEZ ids for Africa
-    africa_extent = gpd.read_file(AFRICA_EXTENT_URL).to_crs("EPSG:4326")
+    africa_extent = gpd.read_file(get_reference_file(AFRICA_EXTENT_URL)).to_crs(
+        "EPSG:4326"
+    )
 
-    worldcereal_aez = gpd.read_file(WORLDCEREAL_AEZ_URL).to_crs("EPSG:4326")
+    worldcereal_aez = gpd.read_file(get_reference_file(WORLDCEREAL_AEZ_URL)).to_crs(
+        "EPSG:4326"
+    )
 
     africa_worldcereal_aez_ids = worldcereal_aez.sjoin(
         africa_extent, predicate="intersects", how="inner"
@@ -27,7 +27,12 @@ from yarl import URL
 
 from deafrica.click_options import slack_url
 from deafrica.logs import setup_logging
-from deafrica.utils import AFRICA_BBOX, AFRICA_EXTENT_BBOX_URL, send_slack_notification
+from deafrica.utils import (
+    AFRICA_BBOX,
+    AFRICA_EXTENT_BBOX_URL,
+    get_derived_reference,
+    send_slack_notification,
+)
 
 VALID_YEARS = [
     "1996",
@@ -90,13 +95,21 @@ def get_gmw_africa_tiles() -> Set[str]:
     set[str]
         Labels for Global Mangrove Watch tiles over Africa.
     """
-    africa_extent = gpd.read_file(AFRICA_EXTENT_BBOX_URL).to_crs("EPSG:4326")
+
+    def build_gmw_africa_tiles(africa_extent_path: str, gmw_tiles_path: str) -> set:
+        africa_extent = gpd.read_file(africa_extent_path).to_crs("EPSG:4326")
+        gmw_tiles = gpd.read_file(gmw_tiles_path).to_crs("EPSG:4326")
+        return set(
+            africa_extent.sjoin(gmw_tiles, how="inner", predicate="intersects")[
+                "tile"
+            ].values
+        )
+
     gmw_tiles_url = SOURCE_URL_PATH / "gmw_v3_tiles.geojson"
-    gmw_tiles = gpd.read_file(str(gmw_tiles_url)).to_crs("EPSG:4326")
-    gmw_africa_tiles = set(
-        africa_extent.sjoin(gmw_tiles, how="inner", predicate="intersects")[
-            "tile"
-        ].values
+    gmw_africa_tiles = get_derived_reference(
+        name="gmw_africa_tiles",
+        urls=[AFRICA_EXTENT_BBOX_URL, str(gmw_tiles_url)],
+        build=build_gmw_africa_tiles,
     )
     return gmw_africa_tiles
 
@@ -15,6 +15,7 @@ from rio_stac import create_stac_item
 from shapely.geometry import Polygon
 
 from deafrica.logs import setup_logging
+from deafrica.utils import get_reference_file
 
 AFRICA_EXTENT = "https://raw.githubusercontent.com/digitalearthafrica/deafrica-extent/master/africa-extent.json"
 
@@ -250,8 +251,9 @@ def run(
     update_metadata: bool,
     log: Logger,
 ):
-    json = requests.get(AFRICA_EXTENT).json()
-    africa_polygon = Polygon(json["features"][0]["geometry"]["coordinates"][0])
+    with open(get_reference_file(AFRICA_EXTENT)) as f:
+        africa_extent = json.load(f)
+    africa_polygon = Polygon(africa_extent["features"][0]["geometry"]["coordinates"][0])
 
     for x in range(MIN_X, MAX_X, 2):
         for y in range(MIN_Y, MAX_Y, 2):
@@ -1,13 +1,55 @@
 import csv
+import hashlib
+import io
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, closing
+from functools import lru_cache, reduce
 from gzip import GzipFile
-from io import BytesIO
+from itertools import islice
+from pathlib import Path
 from types import SimpleNamespace
+from typing import Callable, Iterable, Iterator, Optional
 
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.orc as orc
 import pyarrow.parquet as pq
-from odc.aws import s3_client, s3_fetch, s3_ls_dir
+import botocore.session
+from botocore import UNSIGNED
+from botocore.config import Config
+from odc.aws import s3_client, s3_fetch, s3_head_object, s3_ls_dir, s3_open
+
+from deafrica.utils import map_bounded
+
+# botocore's default connection pool size.
+DEFAULT_POOL_SIZE = 10
+
+# Read size used when pulling byte ranges of inventory data files from S3.
+RANGE_READ_SIZE = 8 * 1024**2
+
+# Number of CSV records gathered into one batch before the key filter is applied.
+CSV_BATCH_SIZE = 100_000
+
+# Canonical names and types of the inventory fields returned by
+# list_inventory_batches, keyed by their normalised name.
+INVENTORY_FIELDS = {
+    "bucket": pa.field("Bucket", pa.string()),
+    "key": pa.field("Key", pa.string()),
+    "size": pa.field("Size", pa.int64()),
+    "lastmodifieddate": pa.field("LastModifiedDate", pa.timestamp("ms", tz="UTC")),
+}
+
+# Local directory for decoded and filtered inventory data files, disabled if unset.
+INVENTORY_CACHE_DIR = os.getenv("INVENTORY_CACHE_DIR")
+
+# Start method of the decode worker processes. Forking a process while
+# boto3/urllib3 threads hold locks can deadlock the child, the workers are
+# forked from a single threaded server process instead.
+DECODE_START_METHOD = "forkserver"
 
 
 def find_latest_manifest(prefix, s3, **kw) -> str:
@@ -23,7 +65,204 @@ def find_latest_manifest(prefix, s3, **kw) -> str:
                 return d + "manifest.json"
 
 
-def retrieve_manifest_files(key: str, s3, schema, file_format, **kw):
+class S3RangeReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over an S3 object.
+
+    Every read is served by a ranged ``GetObject`` request, so columnar
+    readers such as ``pyarrow.parquet.ParquetFile`` only download the
+    footer and the column chunks they actually decode.
+    """
+
+    def __init__(self, url: str, s3, size: Optional[int] = None, **kw):
+        self.url = url
+        self._s3 = s3
+        self._kw = kw
+        if size is None:
+            head = s3_head_object(url, s3=s3, **kw)
+            if head is None:
+                raise FileNotFoundError(url)
+            size = head["ContentLength"]
+        self._size = int(size)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence value {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        end = min(self._pos + len(buffer), self._size)
+        if end <= self._pos:
+            return 0
+        data = s3_fetch(self.url, s3=self._s3, range=(self._pos, end), **self._kw)
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        return n
+
+
+def normalise_column_name(name: str) -> str:
+    """
+    Name of an inventory field with case and underscores removed
+    """
+    return name.lower().replace("_", "")
+
+
+def resolve_columns(names: list[str], columns: Optional[list[str]]) -> list[str]:
+    """
+    Map requested column names onto the names used by an inventory file.
+
+    Matching ignores case and underscores, since CSV inventories use
+    ``LastModifiedDate`` while Parquet inventories use ``last_modified_date``.
+    The key column is always included, as it is needed to filter records.
+    """
+    if columns is None:
+        return list(names)
+
+    lookup = {normalise_column_name(name): name for name in names}
+    resolved = []
+    for column in ["key", *columns]:
+        name = lookup.get(normalise_column_name(column))
+        if name is None:
+            raise ValueError(f"Column {column} not found in inventory schema {names}")
+        if name not in resolved:
+            resolved.append(name)
+    return resolved
+
+
+def row_group_may_match(
+    metadata: pq.FileMetaData, row_group: int, column: int, prefix: str
+) -> bool:
+    """
+    Whether a Parquet row group can hold keys starting with prefix, going by
+    the min/max statistics of the key column. Row groups without statistics
+    are always read.
+    """
+    statistics = metadata.row_group(row_group).column(column).statistics
+    if not prefix or statistics is None or not statistics.has_min_max:
+        return True
+    key_min, key_max = statistics.min, statistics.max
+    if isinstance(key_min, bytes):
+        key_min, key_max = key_min.decode("utf8"), key_max.decode("utf8")
+    return key_max >= prefix and (key_min < prefix or key_min.startswith(prefix))
+
+
+def iter_parquet_row_groups(
+    key: str, s3, columns: Optional[list[str]] = None, prefix: str = "", **kw
+) -> Iterator[pa.Table]:
+    """
+    Stream a Parquet inventory data file one row group at a time.
+
+    Only the footer and the column chunks of the requested columns are
+    downloaded, so memory use is bounded by the size of a single row group.
+    If prefix is given, row groups whose key statistics rule out the prefix
+    are skipped without being downloaded.
+
+    :param key: (str) s3:// url of the Parquet data file
+    :param s3: (aws client)
+    :param columns: (List(str)) columns to read, default is all columns
+    :param prefix: (str) key prefix used to skip row groups
+    :return: pyarrow.Table per row group
+    """
+    reader = io.BufferedReader(S3RangeReader(key, s3, **kw), RANGE_READ_SIZE)
+    with pq.ParquetFile(reader) as parquet_file:
+        names = parquet_file.schema_arrow.names
+        columns = resolve_columns(names, columns)
+        key_index = parquet_file.schema.names.index(get_key_column(names))
+        for i in range(parquet_file.num_row_groups):
+            if not row_group_may_match(parquet_file.metadata, i, key_index, prefix):
+                logging.debug(f"Skipping row group {i} of {key}")
+                continue
+            yield parquet_file.read_row_group(i, columns=columns)
+
+
+def iter_orc_stripes(
+    key: str, s3, columns: Optional[list[str]] = None, **kw
+) -> Iterator[pa.Table]:
+    """
+    Stream an ORC inventory data file one stripe at a time.
+
+    Like the Parquet reader, only the file tail and the streams of the
+    requested columns are downloaded.
+
+    :param key: (str) s3:// url of the ORC data file
+    :param s3: (aws client)
+    :param columns: (List(str)) columns to read, default is all columns
+    :return: pyarrow.Table per stripe
+    """
+    reader = io.BufferedReader(S3RangeReader(key, s3, **kw), RANGE_READ_SIZE)
+    orc_file = orc.ORCFile(reader)
+    columns = resolve_columns(orc_file.schema.names, columns)
+    for i in range(orc_file.nstripes):
+        yield pa.Table.from_batches([orc_file.read_stripe(i, columns=columns)])
+
+
+def retrieve_manifest_batches(
+    key: str,
+    s3,
+    schema,
+    file_format,
+    columns: Optional[list[str]] = None,
+    prefix: str = "",
+    **kw,
+) -> Iterator[pa.Table]:
+    """
+    Retrieve manifest file and return its records as pyarrow Tables of string
+    (CSV) or typed (Parquet, ORC) columns, one batch at a time.
+
+    If columns is given only those fields (plus the key) are read. For
+    Parquet, prefix is used to skip row groups that cannot match it, the
+    returned records still need to be filtered.
+    """
+    if file_format == "CSV" and schema is not None:
+        fields = resolve_columns(schema, columns)
+        indices = [schema.index(field) for field in fields]
+        # Decompress and parse while the object downloads, so only the
+        # current batch is held in memory rather than the whole file.
+        with closing(s3_open(key, s3=s3, **kw)) as body:
+            gz = GzipFile(fileobj=body, mode="r")
+            text = io.TextIOWrapper(gz, encoding="utf8", newline="")
+            csv_rdr = csv.reader(text)
+            while True:
+                rows = list(islice(csv_rdr, CSV_BATCH_SIZE))
+                if not rows:
+                    break
+                yield pa.table(
+                    {
+                        f: pa.array([rec[i] for rec in rows])
+                        for f, i in zip(fields, indices)
+                    }
+                )
+    elif file_format == "PARQUET" and schema is None:
+        yield from iter_parquet_row_groups(
+            key, s3, columns=columns, prefix=prefix, **kw
+        )
+    elif file_format == "ORC" and schema is None:
+        yield from iter_orc_stripes(key, s3, columns=columns, **kw)
+
+
+def retrieve_manifest_files(
+    key: str, s3, schema, file_format, columns: Optional[list[str]] = None, **kw
+):
     """
     Retrieve manifest file and return a namespace
 
@@ -33,21 +272,12 @@ def retrieve_manifest_files(key: str, s3, schema, file_format, **kw):
         LastModifiedDate=<date>,
         Size=<size>
     )
+
+    If columns is given only those fields (plus the key) are set on the namespace.
     """
-    if file_format == "CSV" and schema is not None:
-        bb = s3_fetch(key, s3=s3, **kw)
-        gz = GzipFile(fileobj=BytesIO(bb), mode="r")
-        csv_rdr = csv.reader(line.decode("utf8") for line in gz)
-        for rec in csv_rdr:
-            yield SimpleNamespace(**dict(zip(schema, rec)))
-    elif file_format == "PARQUET" and schema is None:
-        bb = s3_fetch(key, s3=s3, **kw)
-        table = pq.read_table(BytesIO(bb))
-        df = table.to_pandas()
-        assert (table.schema.names == df.columns).all()
-        for row in df.itertuples(index=False):
-            row_as_dict = dict(zip(row._fields, row))
-            yield SimpleNamespace(**row_as_dict)
+    for table in retrieve_manifest_batches(key, s3, schema, file_format, columns, **kw):
+        for row in table.to_pylist():
+            yield SimpleNamespace(**row)
 
 
 def test_key(
@@ -72,33 +302,117 @@ def test_key(
     return False
 
 
-def list_inventory(
-    manifest,
-    s3=None,
+def compile_key_filter(
     prefix: str = "",
     suffix: str = "",
     contains: str = "",
     multiple_contains: tuple[str, str] = None,
-    n_threads: int = None,
-    **kw,
-):
+) -> Callable[[pa.Array], pa.Array]:
     """
-    Returns a generator of inventory records
+    Vectorised version of test_key.
 
-    manifest -- s3:// url to manifest.json or a folder in which case latest one is chosen.
+    Returns a function that takes an array of keys and returns a boolean
+    mask of the keys that pass the same prefix/suffix/contains tests.
+    """
+    substrings = [contains] if multiple_contains is None else list(multiple_contains)
 
-    :param manifest: (str)
-    :param s3: (aws client)
-    :param prefix: (str)
-    :param prefixes: (List(str)) allow multiple prefixes to be searched
-    :param suffix: (str)
-    :param contains: (str)
-    :param n_threads: (int) number of threads, if not sent does not use threads
-    :return: SimpleNamespace
+    def key_filter(keys: pa.Array) -> pa.Array:
+        if not substrings:
+            return pa.repeat(False, len(keys))
+
+        masks = []
+        if prefix:
+            masks.append(pc.starts_with(keys, pattern=prefix))
+        if suffix:
+            masks.append(pc.ends_with(keys, pattern=suffix))
+        if "" not in substrings:
+            masks.append(
+                reduce(
+                    pc.or_,
+                    [pc.match_substring(keys, pattern=c) for c in substrings],
+                )
+            )
+
+        if not masks:
+            return pa.repeat(True, len(keys))
+        return reduce(pc.and_, masks)
+
+    return key_filter
+
+
+def get_key_column(names: list[str]) -> str:
+    """
+    Return the name of the key column, ``Key`` for CSV and ``key`` for Parquet
+    """
+    for name in names:
+        if name.lower() == "key":
+            return name
+    raise ValueError(f"Key column not found in inventory schema {names}")
+
+
+def filter_batches(
+    tables: Iterable[pa.Table], key_filter: Callable[[pa.Array], pa.Array]
+) -> Iterator[pa.Table]:
+    """
+    Apply a compiled key filter to a stream of inventory batches
+    """
+    for table in tables:
+        keys = table.column(get_key_column(table.column_names))
+        filtered = table.filter(key_filter(keys))
+        if filtered.num_rows:
+            yield filtered
+
+
+def get_cache_path(cache_dir: str, checksum: str, **params) -> Path:
+    """
+    Path of the cached, filtered copy of an inventory data file.
+
+    The file is identified by the MD5 checksum listed in the manifest, and
+    the filter and column parameters are hashed into the name so different
+    filters on the same data file do not collide.
+    """
+    params_hash = hashlib.md5(
+        json.dumps(params, sort_keys=True, default=list).encode()
+    ).hexdigest()
+    return Path(cache_dir) / f"{checksum}-{params_hash[:16]}.arrow"
+
+
+def read_cached_batches(path: Path) -> list[pa.Table]:
+    """
+    Memory map a cached inventory data file. The returned table references
+    the mapped file directly instead of copying it into memory.
+    """
+    source = pa.memory_map(str(path), "r")
+    table = pa.ipc.open_file(source).read_all()
+    return [table] if table.num_rows else []
+
+
+def write_cached_batches(path: Path, tables: list[pa.Table]):
+    """
+    Write filtered inventory batches to the cache as an Arrow IPC file.
+
+    The file is written under a temporary name and then renamed, so
+    concurrent readers on the same node never see a partial file.
     """
-    # pylint: disable=too-many-locals
-    s3 = s3 or s3_client()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.concat_tables(tables) if tables else pa.table({})
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
 
+
+def read_manifest(manifest, s3, **kw) -> SimpleNamespace:
+    """
+    Fetch and validate an inventory manifest
+
+    :param manifest: (str) s3:// url to manifest.json or a folder in which
+        case latest one is chosen.
+    :param s3: (aws client)
+    :return: SimpleNamespace with url, source_bucket, file_format, schema and
+        data_files as (url, MD5 checksum) pairs
+    """
     if manifest.endswith("/"):
         manifest = find_latest_manifest(manifest, s3, **kw)
 
@@ -111,55 +425,353 @@ def list_inventory(
         raise ValueError("Manifest file haven't parsed correctly")
 
     file_format = info["fileFormat"].upper()
-    accepted_file_formats = ["CSV", "PARQUET"]
+    accepted_file_formats = ["CSV", "PARQUET", "ORC"]
     if file_format not in accepted_file_formats:
         raise ValueError(f"Data is not in {' or '.join(accepted_file_formats)} format")
 
     s3_prefix = "s3://" + info["destinationBucket"].split(":")[-1] + "/"
-    data_urls = [s3_prefix + f["key"] for f in info["files"]]
+    data_files = [(s3_prefix + f["key"], f.get("MD5checksum")) for f in info["files"]]
 
     if file_format == "CSV":
         schema = tuple(info["fileSchema"].split(", "))
-    elif file_format == "PARQUET":
+    else:
         # Schema parsing is skipped here
-        # as it can be extracted from the parquet file.
+        # as it can be extracted from the parquet or orc file.
         schema = None
 
-    if n_threads:
-        with ThreadPoolExecutor(max_workers=1000) as executor:
-            tasks = [
-                executor.submit(retrieve_manifest_files, key, s3, schema, file_format)
-                for key in data_urls
-            ]
-
-            for future in as_completed(tasks):
-                for namespace in future.result():
-                    try:
-                        key = namespace.Key
-                    except AttributeError:
-                        key = namespace.key
-                    if test_key(
-                        key,
-                        prefix=prefix,
-                        suffix=suffix,
-                        contains=contains,
-                        multiple_contains=multiple_contains,
-                    ):
-                        yield namespace
+    return SimpleNamespace(
+        url=manifest,
+        source_bucket=info.get("sourceBucket"),
+        file_format=file_format,
+        schema=schema,
+        data_files=data_files,
+    )
 
-    else:
-        for u in data_urls:
-            logging.info(f"Retrieve manifest files for {u}")
-            for namespace in retrieve_manifest_files(u, s3, schema, file_format):
-                try:
-                    key = namespace.Key
-                except AttributeError:
-                    key = namespace.key
-                if test_key(
-                    key,
-                    prefix=prefix,
-                    suffix=suffix,
-                    contains=contains,
-                    multiple_contains=multiple_contains,
-                ):
-                    yield namespace
+
+def decode_data_file(
+    url: str,
+    s3,
+    schema,
+    file_format: str,
+    columns: Optional[list[str]] = None,
+    **filters,
+) -> list[pa.Table]:
+    """
+    Download, decode and filter one inventory data file
+
+    :param url: (str) s3:// url of the data file
+    :param s3: (aws client)
+    :param columns: (List(str)) inventory fields to read
+    :param filters: prefix, suffix, contains and multiple_contains key filters
+    :return: (List(pyarrow.Table)) filtered records
+    """
+    key_filter = compile_key_filter(**filters)
+    tables = retrieve_manifest_batches(
+        url, s3, schema, file_format, columns, prefix=filters.get("prefix", "")
+    )
+    return list(filter_batches(tables, key_filter))
+
+
+def get_client_config(s3) -> dict:
+    """
+    Arguments to recreate an S3 client in another process, botocore clients
+    cannot be pickled. The region, endpoint and unsigned access are kept.
+
+    Credentials are not forwarded: worker processes find their own through
+    the default chain (environment variables, AWS_PROFILE, container or
+    instance role). Keys or a profile passed explicitly to the caller's
+    client are not seen by the workers.
+    """
+    return {
+        "region_name": s3.meta.region_name,
+        "endpoint_url": s3.meta.endpoint_url,
+        "aws_unsigned": s3.meta.config.signature_version == UNSIGNED,
+    }
+
+
+@lru_cache(maxsize=None)
+def get_process_client(
+    region_name: str = None, endpoint_url: str = None, aws_unsigned: bool = False
+):
+    """
+    S3 client of a decode worker process, created once per process
+    """
+    return botocore.session.get_session().create_client(
+        "s3",
+        region_name=region_name,
+        endpoint_url=endpoint_url,
+        config=Config(signature_version=UNSIGNED) if aws_unsigned else None,
+    )
+
+
+def start_process_pool(n_processes: int) -> ProcessPoolExecutor:
+    """
+    Start the decode worker processes with DECODE_START_METHOD. Workers are
+    created on the first submits, which is done here, before the threads
+    reading the inventory are started.
+    """
+    executor = ProcessPoolExecutor(
+        n_processes, mp_context=multiprocessing.get_context(DECODE_START_METHOD)
+    )
+    for future in [executor.submit(os.getpid) for _ in range(n_processes)]:
+        future.result()
+    return executor
+
+
+def decode_data_file_in_process(
+    url: str, client_config: dict, *args, **kwargs
+) -> list[pa.Table]:
+    """
+    decode_data_file for a worker process. The filtered records are
+    combined into a single table so they are pickled back in one piece.
+    """
+    s3 = get_process_client(**client_config)
+    tables = decode_data_file(url, s3, *args, **kwargs)
+    if not tables:
+        return []
+    return [pa.concat_tables(tables).combine_chunks()]
+
+
+def iter_inventory_tables(
+    manifest_info: SimpleNamespace,
+    s3,
+    prefix: str = "",
+    suffix: str = "",
+    contains: str = "",
+    multiple_contains: tuple[str, str] = None,
+    n_threads: int = None,
+    columns: list[str] = None,
+    max_in_flight: int = None,
+    cache_dir: str = INVENTORY_CACHE_DIR,
+    decode_processes: int = None,
+) -> Iterator[pa.Table]:
+    """
+    Returns a generator of filtered inventory tables
+
+    :param manifest_info: (SimpleNamespace) manifest returned by read_manifest
+    :param s3: (aws client)
+    :param n_threads: (int) number of threads, if not sent does not use threads
+    :param columns: (List(str)) inventory fields to read. The key is always read.
+    :param max_in_flight: (int) maximum number of data files being downloaded
+        or held in memory at once, defaults to n_threads
+    :param cache_dir: (str) directory where filtered data files are cached by
+        their manifest MD5 checksum
+    :param decode_processes: (int) number of worker processes that download,
+        decompress and filter data files, if not sent decoding happens in the
+        calling process. n_threads defaults to this number. The workers find
+        their own credentials, see get_client_config.
+    :return: pyarrow.Table
+    """
+    data_files = manifest_info.data_files
+
+    filters = {
+        "prefix": prefix,
+        "suffix": suffix,
+        "contains": contains,
+        "multiple_contains": multiple_contains,
+    }
+    decode_args = (manifest_info.schema, manifest_info.file_format, columns)
+
+    with ExitStack() as stack:
+        if decode_processes:
+            executor = stack.enter_context(start_process_pool(decode_processes))
+            client_config = get_client_config(s3)
+            n_threads = n_threads or decode_processes
+
+            def decode(url: str) -> list[pa.Table]:
+                return executor.submit(
+                    decode_data_file_in_process,
+                    url,
+                    client_config,
+                    *decode_args,
+                    **filters,
+                ).result()
+
+        else:
+
+            def decode(url: str) -> list[pa.Table]:
+                return decode_data_file(url, s3, *decode_args, **filters)
+
+        def retrieve_filtered_batches(data_file: tuple[str, str]) -> list[pa.Table]:
+            url, checksum = data_file
+            cache_path = None
+            if cache_dir and checksum:
+                cache_path = get_cache_path(
+                    cache_dir, checksum, columns=columns, **filters
+                )
+                if cache_path.exists():
+                    logging.info(f"Reading cached manifest files for {url}")
+                    return read_cached_batches(cache_path)
+
+            logging.info(f"Retrieve manifest files for {url}")
+            tables = decode(url)
+            if cache_path is not None:
+                write_cached_batches(cache_path, tables)
+            return tables
+
+        if n_threads:
+            results = map_bounded(
+                retrieve_filtered_batches,
+                data_files,
+                n_threads=n_threads,
+                max_in_flight=max_in_flight,
+            )
+        else:
+            results = map(retrieve_filtered_batches, data_files)
+
+        for tables in results:
+            yield from tables
+
+
+def get_inventory_client(s3=None, n_threads: int = None):
+    """
+    Create an S3 client with enough pooled connections for n_threads, or
+    warn if the client passed in has too few
+    """
+    if s3 is None:
+        return s3_client(max_pool_connections=max(n_threads or 0, DEFAULT_POOL_SIZE))
+    if n_threads and s3.meta.config.max_pool_connections < n_threads:
+        logging.warning(
+            f"S3 client has {s3.meta.config.max_pool_connections} pooled connections "
+            f"for {n_threads} threads, create it with max_pool_connections={n_threads}"
+        )
+    return s3
+
+
+def list_inventory(
+    manifest,
+    s3=None,
+    prefix: str = "",
+    suffix: str = "",
+    contains: str = "",
+    multiple_contains: tuple[str, str] = None,
+    n_threads: int = None,
+    columns: list[str] = None,
+    max_in_flight: int = None,
+    cache_dir: str = INVENTORY_CACHE_DIR,
+    decode_processes: int = None,
+    **kw,
+):
+    """
+    Returns a generator of inventory records
+
+    manifest -- s3:// url to manifest.json or a folder in which case latest one is chosen.
+
+    :param manifest: (str)
+    :param s3: (aws client)
+    :param prefix: (str)
+    :param prefixes: (List(str)) allow multiple prefixes to be searched
+    :param suffix: (str)
+    :param contains: (str)
+    :param n_threads: (int) number of threads, if not sent does not use threads
+    :param columns: (List(str)) inventory fields to read, e.g. ["Key"].
+        The key is always read. Default is all fields.
+    :param max_in_flight: (int) maximum number of data files being downloaded
+        or held in memory at once, defaults to n_threads
+    :param cache_dir: (str) directory where filtered data files are cached by
+        their manifest MD5 checksum, defaults to $INVENTORY_CACHE_DIR.
+        Caching is disabled if not set.
+    :param decode_processes: (int) number of worker processes that download,
+        decompress and filter data files, if not sent decoding happens in
+        threads of the calling process
+    :return: SimpleNamespace
+    """
+    s3 = get_inventory_client(s3, n_threads)
+    manifest_info = read_manifest(manifest, s3, **kw)
+
+    tables = iter_inventory_tables(
+        manifest_info,
+        s3,
+        prefix=prefix,
+        suffix=suffix,
+        contains=contains,
+        multiple_contains=multiple_contains,
+        n_threads=n_threads,
+        columns=columns,
+        max_in_flight=max_in_flight,
+        cache_dir=cache_dir,
+        decode_processes=decode_processes,
+    )
+    for table in tables:
+        for row in table.to_pylist():
+            yield SimpleNamespace(**row)
+
+
+def normalise_table(table: pa.Table) -> pa.Table:
+    """
+    Rename and cast the Bucket, Key, Size and LastModifiedDate fields of an
+    inventory table to the types in INVENTORY_FIELDS. CSV inventories are
+    decoded as strings and Parquet inventories use snake case names, so this
+    gives both formats the same schema. Other fields are left as they are.
+    """
+    names = []
+    arrays = []
+    for name, column in zip(table.column_names, table.columns):
+        field = INVENTORY_FIELDS.get(normalise_column_name(name))
+        if field is not None:
+            name = field.name
+            if column.type != field.type:
+                column = column.cast(field.type)
+        names.append(name)
+        arrays.append(column)
+    return pa.table(arrays, names=names)
+
+
+def list_inventory_batches(
+    manifest,
+    s3=None,
+    prefix: str = "",
+    suffix: str = "",
+    contains: str = "",
+    multiple_contains: tuple[str, str] = None,
+    n_threads: int = None,
+    columns: list[str] = None,
+    max_in_flight: int = None,
+    cache_dir: str = INVENTORY_CACHE_DIR,
+    decode_processes: int = None,
+    **kw,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Returns a generator of inventory record batches
+
+    Same as list_inventory, but records are returned as pyarrow.RecordBatch
+    with typed Bucket (string), Key (string), Size (int64) and
+    LastModifiedDate (timestamp) columns, whatever the inventory format.
+    Use pyarrow.Table.from_batches to collect them or hand them to
+    pandas or DuckDB.
+
+    :param manifest: (str)
+    :param s3: (aws client)
+    :param prefix: (str)
+    :param suffix: (str)
+    :param contains: (str)
+    :param n_threads: (int) number of threads, if not sent does not use threads
+    :param columns: (List(str)) inventory fields to read, e.g. ["Key", "Size"].
+        The key is always read. Default is all fields.
+    :param max_in_flight: (int) maximum number of data files being downloaded
+        or held in memory at once, defaults to n_threads
+    :param cache_dir: (str) directory where filtered data files are cached by
+        their manifest MD5 checksum, defaults to $INVENTORY_CACHE_DIR.
+    :param decode_processes: (int) number of worker processes that download,
+        decompress and filter data files, if not sent decoding happens in
+        threads of the calling process
+    :return: pyarrow.RecordBatch
+    """
+    s3 = get_inventory_client(s3, n_threads)
+    manifest_info = read_manifest(manifest, s3, **kw)
+
+    tables = iter_inventory_tables(
+        manifest_info,
+        s3,
+        prefix=prefix,
+        suffix=suffix,
+        contains=contains,
+        multiple_contains=multiple_contains,
+        n_threads=n_threads,
+        columns=columns,
+        max_in_flight=max_in_flight,
+        cache_dir=cache_dir,
+        decode_processes=decode_processes,
+    )
+    for table in tables:
+        yield from normalise_table(table).to_batches()
@@ -1,6 +1,56 @@
+import gzip
 import json
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from types import SimpleNamespace
+from typing import Iterable, Optional, Union
 
-from odc.aws import s3_client, s3_fetch, s3_ls_dir
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+from odc.aws import s3_client, s3_dump, s3_fetch, s3_ls_dir
+from sqlalchemy import and_, func, select
+
+from deafrica.utils import map_bounded, split_list_equally
+
+try:
+    # Tables of the postgres index driver, used to export datasets without
+    # building a Dataset per row. They are internals of datacube, so the
+    # export falls back to the public search API if they're not found.
+    from datacube.drivers.postgres._schema import DATASET, DATASET_LOCATION
+except ImportError:
+    DATASET = DATASET_LOCATION = None
+
+Keys = Union[Iterable[str], pa.Array, pa.ChunkedArray]
+
+# Folder, under a report folder, holding the state of incremental gap reports
+GAP_STATE_FOLDER = "state"
+
+# Folder, under a report folder, holding the sharded copy of the gap reports,
+# and number of keys per shard
+GAP_REPORT_SHARDS_FOLDER = "shards"
+GAP_REPORT_SHARD_SIZE = 10_000
+
+# Age in days after which incremental gap reports rebuild their state from
+# scratch. This picks up ODC datasets archived since the last full run,
+# which the indexed_time watermark cannot see.
+GAP_STATE_MAX_AGE_DAYS = int(os.getenv("GAP_STATE_MAX_AGE_DAYS", "7"))
+
+ODC_SCHEMA = pa.schema(
+    [("key", pa.string()), ("indexed_time", pa.timestamp("us", tz="UTC"))]
+)
+ODC_URI_SCHEMA = pa.schema(
+    [("uri", pa.string()), ("indexed_time", pa.timestamp("us", tz="UTC"))]
+)
+
+# Rows fetched per round trip from the server-side cursor when exporting ODC
+# datasets, and ranges of indexed time each product is split into
+ODC_FETCH_SIZE = 50_000
+ODC_EXPORT_PARTITIONS = int(os.getenv("ODC_EXPORT_PARTITIONS", "4"))
 
 
 def find_latest_report(
@@ -13,7 +63,12 @@ def find_latest_report(
 
     s3 = s3_client(region_name="af-south-1")
 
-    report_files = list(s3_ls_dir(uri=report_folder_path, s3=s3))
+    # Skip folders, such as the state and shards of the reports
+    report_files = [
+        report
+        for report in s3_ls_dir(uri=report_folder_path, s3=s3)
+        if not report.endswith("/")
+    ]
 
     if contains is not None:
         report_files = [report for report in report_files if contains in report]
@@ -72,3 +127,498 @@ def read_report_missing_odc_scenes(report_path: str, limit=None):
         missing_scene_paths = missing_scene_paths[: int(limit)]
 
     return missing_scene_paths
+
+
+# Readers of the lists of reports written without shards
+REPORT_READERS = {
+    "missing": read_report_missing_scenes,
+    "missing_odc": read_report_missing_odc_scenes,
+}
+
+
+def get_report_shards_url(report_path: str) -> str:
+    """
+    Folder holding the sharded copy of a gap report
+    """
+    report_folder, report_name = report_path.rsplit("/", 1)
+    return f"{report_folder}/{GAP_REPORT_SHARDS_FOLDER}/{report_name}"
+
+
+def write_gap_report(report_path: str, report: dict, s3):
+    """
+    Write a gap report as JSON, and a sharded copy of it for the gap fillers.
+
+    Each list of the report is sorted and written to <name>.gz as gzip members
+    of GAP_REPORT_SHARD_SIZE keys each. index.json, written last, holds the
+    number of keys and the byte offset, size and number of keys of every shard,
+    so a worker range-reads only the shards holding its slice.
+
+    :param report_path: (str) s3:// url of the JSON report
+    :param report: (dict) lists or pyarrow string arrays of keys by name,
+        e.g. missing, orphan
+    :param s3: (aws client)
+    """
+    report = {name: to_key_array(keys) for name, keys in report.items()}
+    s3_dump(
+        data=json.dumps({name: keys.to_pylist() for name, keys in report.items()}),
+        url=report_path,
+        s3=s3,
+        ContentType="application/json",
+    )
+
+    shards_url = get_report_shards_url(report_path)
+    index = {"shard_size": GAP_REPORT_SHARD_SIZE, "keys": {}}
+    for name, keys in report.items():
+        keys = keys.filter(pc.not_equal(keys, ""))
+        keys = keys.take(pc.sort_indices(keys))
+        shards = []
+        data = BytesIO()
+        for start in range(0, len(keys), GAP_REPORT_SHARD_SIZE):
+            shard_keys = keys[start : start + GAP_REPORT_SHARD_SIZE].to_pylist()
+            shard = gzip.compress("".join(f"{key}\n" for key in shard_keys).encode())
+            shards.append([data.tell(), len(shard), len(shard_keys)])
+            data.write(shard)
+        if shards:
+            s3_dump(data=data.getvalue(), url=f"{shards_url}/{name}.gz", s3=s3)
+        index["keys"][name] = {"count": len(keys), "shards": shards}
+
+    s3_dump(
+        data=json.dumps(index),
+        url=f"{shards_url}/index.json",
+        s3=s3,
+        ContentType="application/json",
+    )
+
+
+def read_report_worker_scenes(
+    report_path: str, key: str, idx: int, max_workers: int, limit=None
+) -> tuple[list[str], int]:
+    """
+    Read the slice of a gap report list processed by one worker, the same
+    slice split_list_equally gives. Only the shards holding the slice are
+    read, reports written without shards are read whole.
+
+    :param report_path: (str) s3:// url of the JSON report
+    :param key: (str) report list, e.g. missing or missing_odc
+    :param idx: (int) worker index
+    :param max_workers: (int) number of workers
+    :param limit: (int) only split the first limit keys of the list
+    :return:(tuple) the keys of the worker, empty if it has nothing to process,
+        and the number of keys split among the workers
+    """
+    s3 = s3_client(region_name="af-south-1")
+    shards_url = get_report_shards_url(report_path)
+    try:
+        index = json.loads(s3_fetch(url=f"{shards_url}/index.json", s3=s3))
+    except ClientError:
+        logging.info(f"No shards found for {report_path}, reading the whole report")
+        read_report = REPORT_READERS.get(key)
+        if read_report is None:
+            raise Exception(f"{key} scenes not found")
+        scene_paths = read_report(report_path, limit=limit)
+        split_scenes = split_list_equally(scene_paths, int(max_workers))
+        if len(split_scenes) <= idx:
+            return [], len(scene_paths)
+        return split_scenes[idx], len(scene_paths)
+
+    if index["keys"].get(key, None) is None:
+        raise Exception(f"{key} scenes not found")
+
+    count = index["keys"][key]["count"]
+    if limit:
+        count = min(count, int(limit))
+    if count == 0:
+        return [], count
+
+    worker_size = math.ceil(count / int(max_workers))
+    start = idx * worker_size
+    end = min(start + worker_size, count)
+    if start >= end:
+        return [], count
+
+    # Shards overlapping [start, end) and the position of the first key read
+    shards = []
+    position = 0
+    first_position = None
+    for offset, size, shard_count in index["keys"][key]["shards"]:
+        if position < end and position + shard_count > start:
+            if first_position is None:
+                first_position = position
+            shards.append((offset, size))
+        position += shard_count
+
+    body = s3_fetch(
+        url=f"{shards_url}/{key}.gz",
+        s3=s3,
+        range=(shards[0][0], shards[-1][0] + shards[-1][1]),
+    )
+    keys = gzip.decompress(body).decode().split("\n")
+
+    scene_paths = [
+        scene_path.strip()
+        for scene_path in keys[start - first_position : end - first_position]
+    ]
+    return scene_paths, count
+
+
+def to_key_array(keys: Keys) -> Union[pa.Array, pa.ChunkedArray]:
+    """
+    Convert keys to a pyarrow string array, which holds them in one buffer
+    """
+    if isinstance(keys, (pa.Array, pa.ChunkedArray)):
+        return keys
+    return pa.array(keys if isinstance(keys, list) else list(keys), pa.string())
+
+
+def common_prefix(*keys: Keys) -> str:
+    """
+    Longest prefix shared by all keys, e.g. the base folder of a bucket.
+
+    In sorted order the keys between the smallest and the largest share
+    their prefix, so only those two are compared.
+    :param keys: pyarrow string arrays
+    :return:(str) the common prefix, empty if there are no keys
+    """
+    bounds = []
+    for array in keys:
+        if len(array) > 0:
+            min_max = pc.min_max(array)
+            bounds += [min_max["min"].as_py(), min_max["max"].as_py()]
+    return os.path.commonprefix(bounds) if bounds else ""
+
+
+def to_sorted_keys(keys: Keys, prefix: str = "") -> pa.Array:
+    """
+    Convert keys to a sorted, de-duplicated pyarrow string array.
+
+    The keys stay in Arrow's offsets and data buffers, so no Python object is
+    built per key and each key only takes its own length.
+    A prefix shared by the keys is stripped, so it's not hashed and compared
+    for every key, and is added back by prefix_keys.
+    :param keys: Python strings or a pyarrow string array
+    :param prefix: prefix of all the keys to strip
+    :return:(pa.Array) sorted unique keys
+    """
+    keys = pc.unique(to_key_array(keys)).cast(pa.large_string())
+    if prefix:
+        keys = pc.utf8_slice_codeunits(keys, start=len(prefix))
+    return keys.take(pc.sort_indices(keys))
+
+
+def anti_join(left: pa.Array, right: pa.Array) -> pa.Array:
+    """
+    Keys of left that are not in right, in the order of left
+    """
+    return left.filter(pc.invert(pc.is_in(left, value_set=right)))
+
+
+def prefix_keys(keys: Keys, prefix: str) -> pa.Array:
+    """
+    Add a prefix, e.g. the url of a bucket, to every key
+    """
+    keys = to_key_array(keys)
+    if isinstance(keys, pa.ChunkedArray):
+        keys = keys.combine_chunks()
+    if not prefix:
+        return keys
+    return pc.binary_join_element_wise(
+        pa.scalar(prefix, keys.type), keys, pa.scalar("", keys.type)
+    )
+
+
+def compute_gaps(
+    source_keys: Keys,
+    destination_keys: Keys,
+    odc_keys: Optional[Keys] = None,
+    odc_indexed_times: Optional[Iterable[datetime]] = None,
+    indexed_before: Optional[datetime] = None,
+) -> SimpleNamespace:
+    """
+    Compare source, destination and ODC keys for a gap report.
+
+    All keys must use the same form, e.g. the object key without the bucket.
+    :param source_keys: keys in the source bucket or bulk file
+    :param destination_keys: keys in the destination bucket
+    :param odc_keys: keys indexed in ODC, if not sent ODC gaps are empty
+    :param odc_indexed_times: indexed time of each of odc_keys
+    :param indexed_before: only ODC keys indexed before this time count as
+        orphans, so scenes indexed since the inventory was taken are ignored
+    :return:(SimpleNamespace) sorted pyarrow string arrays
+        missing - in the source but not in the destination
+        orphan - in the destination but not in the source
+        missing_odc - in the destination but not indexed in ODC
+        orphan_odc - indexed in ODC but not in the destination
+    """
+    source_keys = to_key_array(source_keys)
+    destination_keys = to_key_array(destination_keys)
+    if odc_keys is not None:
+        odc_keys = to_key_array(odc_keys)
+    prefix = common_prefix(
+        source_keys, destination_keys, *([] if odc_keys is None else [odc_keys])
+    )
+
+    source = to_sorted_keys(source_keys, prefix)
+    destination = to_sorted_keys(destination_keys, prefix)
+
+    missing_odc = orphan_odc = to_sorted_keys([])
+    if odc_keys is not None:
+        odc = to_sorted_keys(odc_keys, prefix)
+        missing_odc = anti_join(destination, odc)
+
+        orphans = odc
+        if indexed_before is not None and odc_indexed_times is not None:
+            # Naive times are taken as UTC
+            time_type = ODC_SCHEMA.field("indexed_time").type
+            if isinstance(odc_indexed_times, (pa.Array, pa.ChunkedArray)):
+                times = odc_indexed_times.cast(time_type)
+            else:
+                times = pa.array(list(odc_indexed_times), time_type)
+            stale = pc.less(times, pa.scalar(indexed_before, time_type))
+            orphans = to_sorted_keys(odc_keys.filter(stale), prefix)
+        orphan_odc = anti_join(orphans, destination)
+
+    return SimpleNamespace(
+        missing=prefix_keys(anti_join(source, destination), prefix),
+        orphan=prefix_keys(anti_join(destination, source), prefix),
+        missing_odc=prefix_keys(missing_odc, prefix),
+        orphan_odc=prefix_keys(orphan_odc, prefix),
+    )
+
+
+def split_time_range(start: datetime, end: datetime, n: int) -> list[tuple]:
+    """
+    Split [start, end] into n contiguous [lower, upper) ranges, the last one
+    extended past end so end itself is included
+    """
+    step = (end - start) / n
+    bounds = [start + step * i for i in range(n)] + [end + timedelta(microseconds=1)]
+    return [(lower, upper) for lower, upper in zip(bounds, bounds[1:]) if lower < upper]
+
+
+def export_odc_partition(
+    engine, product_id: int, lower: datetime, upper: datetime
+) -> pa.Table:
+    """
+    Read uri and indexed_time of the active datasets of a product indexed
+    in [lower, upper), streaming rows through a server-side cursor
+    """
+    query = (
+        select(
+            (DATASET_LOCATION.c.uri_scheme + ":" + DATASET_LOCATION.c.uri_body),
+            DATASET.c.added,
+        )
+        .select_from(
+            DATASET.join(
+                DATASET_LOCATION,
+                and_(
+                    DATASET_LOCATION.c.dataset_ref == DATASET.c.id,
+                    DATASET_LOCATION.c.archived.is_(None),
+                ),
+            )
+        )
+        .where(
+            DATASET.c.dataset_type_ref == product_id,
+            DATASET.c.archived.is_(None),
+            DATASET.c.added >= lower,
+            DATASET.c.added < upper,
+        )
+    )
+
+    chunks = []
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, max_row_buffer=ODC_FETCH_SIZE
+        ).execute(query)
+        for rows in result.partitions(ODC_FETCH_SIZE):
+            uris, indexed_times = zip(*rows)
+            chunks.append(
+                pa.table(
+                    [
+                        pa.array(uris, pa.string()),
+                        pa.array(indexed_times, ODC_SCHEMA.field("indexed_time").type),
+                    ],
+                    names=["uri", "indexed_time"],
+                )
+            )
+    if not chunks:
+        return ODC_URI_SCHEMA.empty_table()
+    return pa.concat_tables(chunks)
+
+
+def search_odc_uris(
+    dc, products: Iterable[str], indexed_after: datetime = None
+) -> pa.Table:
+    """
+    Export uri and indexed_time of the active datasets of several products
+    through the public search API, which works on every index driver
+    """
+    uris = []
+    indexed_times = []
+    for product in products:
+        for dataset in dc.index.datasets.search_returning(
+            ["uri", "indexed_time"], product=product
+        ):
+            uris.append(dataset.uri)
+            indexed_times.append(dataset.indexed_time)
+
+    time_type = ODC_URI_SCHEMA.field("indexed_time").type
+    table = pa.table(
+        [pa.array(uris, pa.string()), pa.array(indexed_times, time_type)],
+        schema=ODC_URI_SCHEMA,
+    )
+    if indexed_after is not None:
+        table = table.filter(
+            pc.greater(
+                table.column("indexed_time"), pa.scalar(indexed_after, time_type)
+            )
+        )
+    return table
+
+
+def export_odc_uris(
+    dc,
+    products: Iterable[str],
+    indexed_after: datetime = None,
+    n_partitions: int = ODC_EXPORT_PARTITIONS,
+) -> pa.Table:
+    """
+    Export uri and indexed_time of the active datasets of several products.
+
+    On the postgres index driver each product is split into n_partitions
+    ranges of indexed time, and the partitions are read in parallel on up to
+    n_partitions database connections. Other drivers, or datacube versions
+    without the postgres tables, use search_odc_uris.
+
+    :param dc: (datacube.Datacube)
+    :param products: (List(str)) product names
+    :param indexed_after: (datetime) only export datasets indexed after this
+    :param n_partitions: (int) partitions per product
+    :return:(pa.Table) with uri and indexed_time columns
+    """
+    # The index has no public engine, datacube-explorer reaches it the same way
+    engine = getattr(getattr(dc.index, "_db", None), "_engine", None)
+    if dc.index.name != "pg_index" or engine is None or DATASET is None:
+        logging.warning(
+            f"No partitioned export for the {dc.index.name} index, "
+            f"searching datasets of {products}"
+        )
+        return search_odc_uris(dc, products, indexed_after=indexed_after)
+
+    partitions = []
+    for product in products:
+        product_id = dc.index.products.get_by_name(product).id
+        query = select(func.min(DATASET.c.added), func.max(DATASET.c.added)).where(
+            DATASET.c.dataset_type_ref == product_id, DATASET.c.archived.is_(None)
+        )
+        if indexed_after is not None:
+            query = query.where(DATASET.c.added > indexed_after)
+        with engine.connect() as conn:
+            start, end = conn.execute(query).one()
+        if start is None:
+            continue
+        partitions.extend(
+            (product_id, lower, upper)
+            for lower, upper in split_time_range(start, end, n_partitions)
+        )
+
+    logging.info(f"Exporting {len(partitions)} ODC partitions of {products}")
+    if not partitions:
+        return ODC_URI_SCHEMA.empty_table()
+
+    n_threads = min(len(partitions), n_partitions)
+    tables = list(
+        map_bounded(
+            lambda partition: export_odc_partition(engine, *partition),
+            partitions,
+            n_threads=n_threads,
+        )
+    )
+    return pa.concat_tables(tables)
+
+
+def odc_uris_to_keys(uris: pa.Table, bucket_url: str) -> pa.Table:
+    """
+    Convert exported ODC uris to gap report keys by removing the bucket url
+    they start with. Uris of other buckets are kept as they are.
+    """
+    uri = uris.column("uri")
+    keys = pc.if_else(
+        pc.starts_with(uri, bucket_url),
+        pc.utf8_slice_codeunits(uri, start=len(bucket_url)),
+        uri,
+    )
+    return pa.table([keys, uris.column("indexed_time")], schema=ODC_SCHEMA)
+
+
+def get_watermark(odc: pa.Table) -> Optional[datetime]:
+    """
+    Latest indexed_time of the ODC datasets in a gap report state
+    """
+    return pc.max(odc.column("indexed_time")).as_py()
+
+
+def apply_odc_delta(odc: pa.Table, updated: pa.Table) -> pa.Table:
+    """
+    Add or replace ODC datasets indexed since the last gap report
+    """
+    kept = odc.filter(
+        pc.invert(pc.is_in(odc.column("key"), value_set=updated.column("key")))
+    )
+    return pa.concat_tables([kept, updated.cast(ODC_SCHEMA)])
+
+
+def read_parquet_from_s3(url: str, s3) -> pa.Table:
+    return pq.read_table(BytesIO(s3_fetch(url, s3=s3)))
+
+
+def write_parquet_to_s3(table: pa.Table, url: str, s3):
+    buffer = BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    s3_dump(data=buffer.getvalue(), url=url, s3=s3)
+
+
+def read_gap_state(state_url: str, s3) -> Optional[SimpleNamespace]:
+    """
+    Read the ODC keys saved by the last incremental gap report
+
+    :param state_url: (str) s3:// url of the state folder
+    :param s3: (aws client)
+    :return:(SimpleNamespace) refreshed and odc, None if there is no state or
+        it is older than GAP_STATE_MAX_AGE_DAYS
+    """
+    try:
+        info = json.loads(s3_fetch(f"{state_url}/state.json", s3=s3))
+    except ClientError:
+        logging.info(f"No gap report state found in {state_url}")
+        return None
+
+    refreshed = datetime.fromisoformat(info["refreshed"])
+    if datetime.now(timezone.utc) - refreshed > timedelta(days=GAP_STATE_MAX_AGE_DAYS):
+        logging.info(f"Gap report state was last rebuilt on {refreshed}, rebuilding")
+        return None
+
+    return SimpleNamespace(
+        refreshed=refreshed,
+        odc=read_parquet_from_s3(f"{state_url}/{info['odc']}", s3),
+    )
+
+
+def write_gap_state(state_url: str, state: SimpleNamespace, s3):
+    """
+    Save the ODC keys a gap report was built from, so the next incremental
+    report only queries datasets indexed since. The inventories are read in
+    full by every report, as S3 Inventory rewrites them daily.
+
+    :param state_url: (str) s3:// url of the state folder
+    :param state: (SimpleNamespace) with refreshed and odc
+    :param s3: (aws client)
+    """
+    # Each run writes to its own folder and state.json is replaced last, so
+    # a run that fails part way leaves the previous state intact
+    run_folder = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H-%M-%S")
+    info = {
+        "refreshed": state.refreshed.isoformat(),
+        "odc": f"{run_folder}/odc.parquet",
+    }
+    write_parquet_to_s3(state.odc, f"{state_url}/{info['odc']}", s3)
+    s3_dump(data=json.dumps(info), url=f"{state_url}/state.json", s3=s3)
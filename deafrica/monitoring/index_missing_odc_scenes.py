@@ -12,11 +12,10 @@ from deafrica.click_options import limit, slack_url
 from deafrica.logs import setup_logging
 from deafrica.monitoring.gap_report import (
     find_latest_report,
-    read_report_missing_odc_scenes,
+    read_report_worker_scenes,
 )
 from deafrica.utils import (
     send_slack_notification,
-    split_list_equally,
 )
 
 
@@ -60,25 +59,27 @@ def index_missing_odc_scenes(
     log.info(f"Limited: {int(limit) if limit else 'No limit'}")
     log.info(f"Number of workers: {max_workers}")
 
-    files = read_report_missing_odc_scenes(report_path=latest_report, limit=limit)
-
-    log.info(f"Number of missing ODC scenes found {len(files)}")
-    log.info(f"Example scenes: {files[0:10]}")
-
-    # Split scenes equally among the workers
-    split_list_scenes = split_list_equally(
-        list_to_split=files, num_inter_lists=int(max_workers)
+    # Read only the scenes of this worker, split equally among the workers
+    worker_scenes, total = read_report_worker_scenes(
+        report_path=latest_report,
+        key="missing_odc",
+        idx=idx,
+        max_workers=max_workers,
+        limit=limit,
     )
 
+    log.info(f"Number of missing ODC scenes found {total}")
+    log.info(f"Example scenes: {worker_scenes[0:10]}")
+
     # In case of the index being bigger than the number of positions in the array, the extra POD isn' necessary
-    if len(split_list_scenes) <= idx:
+    if not worker_scenes:
         log.warning(f"Worker {idx} Skipped!")
         sys.exit(0)
 
     log.info(f"Executing worker {idx}")
 
     bucket_name = s3_url_parse(s3_report_folder_path)[0]
-    scene_paths = [f"s3://{bucket_name}/{scene}" for scene in split_list_scenes[idx]]
+    scene_paths = [f"s3://{bucket_name}/{scene}" for scene in worker_scenes]
 
     log.info(f"Worker {idx} to index {len(scene_paths)} scenes")
 
@@ -117,9 +118,9 @@ def index_missing_odc_scenes(
 
     message = dedent(
         f"{error_flag}*Indexing missing scenes for product {product_name} (worker {idx}) - {environment}*\n"
-        f"Total missing ODC scenes: {len(files)}\n"
+        f"Total missing ODC scenes: {total}\n"
         f"Attempted missing ODC scenes to index: {len(scene_paths)}\n"
-        f"Failed missing ODC scenes to index: {len(split_list_scenes[idx]) - len(indexed)}\n"
+        f"Failed missing ODC scenes to index: {len(worker_scenes) - len(indexed)}\n"
         f"Indexed missing ODC scenes: {indexed}\n"
         f"Failed to index missing ODC scenes: {failed}\n"
     )
@@ -17,7 +17,7 @@ from deafrica.click_options import limit, slack_url
 from deafrica.logs import setup_logging
 from deafrica.monitoring.gap_report import (
     find_latest_report,
-    read_report_missing_scenes,
+    read_report_worker_scenes,
 )
 from deafrica.utils import (
     send_slack_notification,
@@ -133,8 +133,13 @@ def fill_the_gap(
 
     log.info(f"Reading missing scenes from the report {latest_report}")
 
-    missing_scene_paths = read_report_missing_scenes(
-        report_path=latest_report, limit=scenes_limit
+    # A single worker, so only the missing scenes shards are read
+    missing_scene_paths, _ = read_report_worker_scenes(
+        report_path=latest_report,
+        key="missing",
+        idx=0,
+        max_workers=1,
+        limit=scenes_limit,
     )
 
     log.info(f"Number of scenes found {len(missing_scene_paths)}")
@@ -8,27 +8,40 @@ s3://deafrica-landsat-dev/status-report/<satellite_date.csv.gz>
 
 from __future__ import annotations
 
-import csv
-import gzip
-import json
 import time
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 from textwrap import dedent
+from types import SimpleNamespace
+from typing import Optional
 
 import click
 import datacube
 import pandas as pd
-from odc.aws import s3_client, s3_dump
+import pyarrow as pa
+import pyarrow.compute as pc
+from odc.aws import s3_client
 from yarl import URL
 
 from deafrica import __version__
-from deafrica.click_options import slack_url, update_stac
-from deafrica.inventory import list_inventory
+from deafrica.click_options import incremental, slack_url, update_stac
+from deafrica.inventory import find_latest_manifest, list_inventory_batches
 from deafrica.logs import setup_logging
+from deafrica.monitoring.gap_report import (
+    GAP_STATE_FOLDER,
+    apply_odc_delta,
+    compute_gaps,
+    export_odc_uris,
+    get_watermark,
+    odc_uris_to_keys,
+    prefix_keys,
+    read_gap_state,
+    write_gap_report,
+    write_gap_state,
+)
 from deafrica.utils import (
-    convert_str_to_date,
-    download_file_to_tmp,
+    get_reference_file,
+    open_file_download,
     send_slack_notification,
     time_process,
 )
@@ -54,70 +67,101 @@ LANDSAT_INVENTORY_PATH = URL(
 
 USGS_S3_BUCKET_PATH = URL("s3://usgs-landsat")
 
+BULK_FILE_COLUMNS = [
+    "Satellite",
+    "Day/Night Indicator",
+    "WRS Path",
+    "WRS Row",
+    "Date Acquired",
+    "Sensor Identifier",
+    "Display ID",
+]
+BULK_FILE_CHUNK_SIZE = 500_000
 
-def get_and_filter_keys_from_files(file_path: Path):
-    """
-    Read scenes from the bulk GZ file and filter
-    :param file_path:
-    :return:
-    """
-
-    def build_path(file_row):
-        # USGS changes - for _ when generates the CSV bulk file
-        identifier = file_row["Sensor Identifier"].lower().replace("_", "-")
-        year_acquired = convert_str_to_date(file_row["Date Acquired"]).year
-
-        return (
-            "collection02/level-2/standard/{identifier}/{year_acquired}/"
-            "{target_path}/{target_row}/{display_id}/".format(
-                identifier=identifier,
-                year_acquired=year_acquired,
-                target_path=file_row["WRS Path"].zfill(3),
-                target_row=file_row["WRS Row"].zfill(3),
-                display_id=file_row["Display ID"],
-            )
-        )
 
-    africa_pathrows = set(
+def get_africa_pathrows() -> set:
+    return set(
         pd.read_csv(
-            str(AFRICA_GZ_PATHROWS_URL),
+            get_reference_file(str(AFRICA_GZ_PATHROWS_URL)),
             header=None,
         ).values.ravel()
     )
 
-    with gzip.open(file_path, "rt") as csv_file:
-        return set(
-            build_path(row)
-            for row in csv.DictReader(csv_file)
-            if (
-                # Filter to skip all LANDSAT_4
-                row.get("Satellite") is not None
-                and row["Satellite"] != "LANDSAT_4"
-                and row["Satellite"] != "4"
-                # Filter to get just day
-                and (
-                    row.get("Day/Night Indicator") is not None
-                    and row["Day/Night Indicator"].upper() == "DAY"
-                )
-                # Filter to get just from Africa
-                and (
-                    row.get("WRS Path") is not None
-                    and row.get("WRS Row") is not None
-                    and int(f"{row['WRS Path'].zfill(3)}{row['WRS Row'].zfill(3)}")
-                    in africa_pathrows
-                )
-            )
-        )
-
 
-def get_and_filter_keys(satellites: tuple[str, str]) -> set:
+def filter_bulk_rows(rows: pd.DataFrame, africa_pathrows: set) -> pd.Series:
     """
-    Retrieve key list from a inventory bucket and filter
+    Build the scene folder of the day time African scenes of a chunk of the bulk file
+    :param rows:(pd.DataFrame) bulk file rows read as strings
+    :param africa_pathrows:(set) African pathrows as integers
+    :return:(pd.Series) scene folders
+    """
+    # Rows missing any of the fields can't be filtered or given a path
+    rows = rows.dropna(subset=BULK_FILE_COLUMNS)
+    wrs_path = rows["WRS Path"].str.zfill(3)
+    wrs_row = rows["WRS Row"].str.zfill(3)
+
+    keep = (
+        # Filter to skip all LANDSAT_4
+        ~rows["Satellite"].isin(["LANDSAT_4", "4"])
+        # Filter to get just day
+        & (rows["Day/Night Indicator"].str.upper() == "DAY")
+        # Filter to get just from Africa
+        & pd.to_numeric(wrs_path + wrs_row, errors="coerce").isin(africa_pathrows)
+    )
+    rows = rows[keep]
+
+    # USGS changes - for _ when generates the CSV bulk file
+    identifier = rows["Sensor Identifier"].str.lower().str.replace("_", "-")
+    # Dates are either YYYY/MM/DD or YYYY-MM-DD
+    year_acquired = rows["Date Acquired"].str[:4]
+
+    return (
+        "collection02/level-2/standard/"
+        + identifier
+        + "/"
+        + year_acquired
+        + "/"
+        + wrs_path[keep]
+        + "/"
+        + wrs_row[keep]
+        + "/"
+        + rows["Display ID"]
+        + "/"
+    )
 
-    :param satellites:tuple[str] a list of satellite names
-    :return:(set)
+
+def get_and_filter_keys_from_files(file_path: Path):
     """
+    Read scenes from the bulk GZ file and filter.
+    Only the columns used to filter and build the paths are parsed, in chunks
+    of BULK_FILE_CHUNK_SIZE rows.
+    :param file_path:(Path) bulk file, or a binary file object of its gzip content
+    :return:(set) scene folders
+    """
+
+    africa_pathrows = get_africa_pathrows()
+
+    source_paths = set()
+    with pd.read_csv(
+        file_path,
+        compression="gzip",
+        usecols=lambda column: column in BULK_FILE_COLUMNS,
+        dtype=str,
+        chunksize=BULK_FILE_CHUNK_SIZE,
+    ) as chunks:
+        for rows in chunks:
+            missing_columns = [
+                column for column in BULK_FILE_COLUMNS if column not in rows.columns
+            ]
+            if missing_columns:
+                raise ValueError(
+                    f"Bulk file {file_path} is missing the columns {missing_columns}"
+                )
+            source_paths.update(filter_bulk_rows(rows, africa_pathrows))
+    return source_paths
 
+
+def get_satellite_prefixes(satellites: tuple[str, str]) -> list[str]:
     sat_prefixes = []
 
     if "ls9" in satellites:
@@ -132,44 +176,101 @@ def get_and_filter_keys(satellites: tuple[str, str]) -> set:
     if len(sat_prefixes) == 0:
         raise ValueError(f"Invalid satellites: {satellites}")
 
-    list_json_keys = list_inventory(
-        manifest=str(LANDSAT_INVENTORY_PATH),
+    return sat_prefixes
+
+
+def to_scene_folders(keys) -> pa.Array:
+    """
+    Scene folder of each STAC document, keeping the trailing slash
+    """
+    if not isinstance(keys, (pa.Array, pa.ChunkedArray)):
+        keys = pa.array(keys, pa.string())
+    return pc.unique(pc.replace_substring_regex(keys, pattern="[^/]*$", replacement=""))
+
+
+def get_and_filter_keys(
+    satellites: tuple[str, str], manifest: str = None, s3=None
+) -> pa.Array:
+    """
+    Retrieve key list from a inventory bucket and filter
+
+    :param satellites:tuple[str] a list of satellite names
+    :param manifest:(str) inventory manifest, defaults to the latest
+    :param s3:(aws client)
+    :return:(pa.Array) unique scene folders
+    """
+
+    batches = list_inventory_batches(
+        manifest=manifest or str(LANDSAT_INVENTORY_PATH),
+        s3=s3,
         prefix="collection02",
         suffix="_stac.json",
-        multiple_contains=sat_prefixes,
+        multiple_contains=get_satellite_prefixes(satellites),
         n_threads=200,
+        columns=["Key"],
     )
-    return set(f"{key.Key.rsplit('/', 1)[0]}/" for key in list_json_keys)
+    list_json_keys = pa.chunked_array(
+        [batch.column("Key") for batch in batches], pa.string()
+    )
+    return to_scene_folders(list_json_keys)
 
 
-def get_odc_keys(satellites: tuple[str, str], log) -> set:
+def get_odc_keys(
+    satellites: tuple[str, str], log, indexed_after: datetime = None
+) -> Optional[pa.Table]:
     try:
         dc = datacube.Datacube()
-        all_odc_vals = {}
-        for sat in satellites:
-            for uri in dc.index.datasets.search_returning(
-                ["uri", "indexed_time"], product=sat + "_sr"
-            ):
-                all_odc_vals[
-                    uri.uri.replace("s3://deafrica-landsat/", "").rsplit("/", 1)[0]
-                    + "/"
-                ] = uri.indexed_time
-        return all_odc_vals
+        uris = export_odc_uris(
+            dc, [sat + "_sr" for sat in satellites], indexed_after=indexed_after
+        )
+        odc_keys = odc_uris_to_keys(uris, "s3://deafrica-landsat/")
+        # Scene folder of each dataset, keeping the trailing slash
+        return odc_keys.set_column(
+            0,
+            "key",
+            pc.replace_substring_regex(
+                odc_keys.column("key"), pattern="[^/]*$", replacement=""
+            ),
+        )
     except Exception:
-        log.info("Error while searching for datasets in odc")
-        return {}
+        # An empty table would report every scene as not indexed, the
+        # ODC gaps are left out of the report instead
+        log.exception("Error while searching for datasets in odc")
+        return None
+
+
+def filter_satellite_keys(keys, satellites: list[str]):
+    """
+    Keep the scene folders of some satellites, e.g. .../LC08_L2SP_188036_.../
+    """
+    pattern = "/(" + "|".join(get_satellite_prefixes(satellites)) + ")_"
+    return keys.filter(pc.match_substring_regex(keys, pattern))
 
 
 def generate_buckets_diff(
     bucket_name: str,
-    satellites: str,
-    file_name: str,
+    satellite_groups: list[str],
     update_stac: bool = False,
     notification_url: str = None,
+    incremental: bool = False,
 ):
     """
     Compare USGS bulk files and Africa inventory bucket detecting differences
     A report containing missing keys will be written to AFRICA_S3_BUCKET_PATH
+    for each satellite group.
+
+    The inventory bucket and ODC are read once for all the groups and their
+    keys split by satellite in memory, each group reads its own bulk file.
+
+    With incremental, the ODC keys saved by the last incremental report are
+    updated with the datasets indexed since, the bulk files and the inventory,
+    which is rewritten daily, are always read in full.
+
+    :param bucket_name:(str) Bucket where the gap reports are
+    :param satellite_groups:(list[str]) satellite groups, e.g. ["ls8_ls9", "ls7"]
+    :param update_stac:(bool) Define if the reports will contain all scenes from the source for an update
+    :param notification_url:(str) Optional slack URL in case of you want to send a slack notification
+    :param incremental:(bool) Start from the ODC keys saved by the last incremental report
     """
 
     log = setup_logging()
@@ -184,151 +285,210 @@ def generate_buckets_diff(
     )
     environment = "DEV" if "dev" in bucket_name else "PDS"
 
-    title = " & ".join(satellites).replace("ls", "Landsat ")
+    satellites = [sat for group in satellite_groups for sat in group.split("_")]
 
     log.info(f"Environment {environment}")
     log.info(f"Bucket Name {bucket_name}")
     log.info(f"Satellites {satellites}")
-    log.info(f"File Name {file_name}")
     log.info(f"Update all ({update_stac})")
     log.info(f"Notification URL ({notification_url})")
 
     # Create connection to the inventory S3 bucket
+    landsat_s3 = s3_client(region_name="af-south-1", max_pool_connections=200)
     log.info(f"Retrieving keys from inventory bucket {LANDSAT_INVENTORY_PATH}")
-    dest_paths = get_and_filter_keys(satellites=satellites)
+    destination_manifest = find_latest_manifest(str(LANDSAT_INVENTORY_PATH), landsat_s3)
+    state_url = str(
+        landsat_status_report_path / GAP_STATE_FOLDER / "_".join(satellites)
+    )
+    state = (
+        read_gap_state(state_url, landsat_s3)
+        if incremental and not update_stac
+        else None
+    )
+
+    dest_paths = get_and_filter_keys(
+        satellites=satellites, manifest=destination_manifest, s3=landsat_s3
+    )
 
     log.info(f"INVENTORY bucket number of objects {len(dest_paths)}")
-    log.info(f"INVENTORY 10 first {list(dest_paths)[0:10]}")
+    log.info(f"INVENTORY 10 first {dest_paths[0:10].to_pylist()}")
+
+    if not update_stac:
+        if state is None:
+            log.info("Retrieving keys from odc")
+            odc = get_odc_keys(satellites, log)
+            refreshed = datetime.now(timezone.utc)
+        else:
+            watermark = get_watermark(state.odc)
+            log.info(f"Retrieving keys from odc indexed after {watermark}")
+            odc = get_odc_keys(satellites, log, indexed_after=watermark)
+            if odc is not None:
+                odc = apply_odc_delta(state.odc, odc)
+            refreshed = state.refreshed
+
+        if odc is None:
+            log.error("ODC keys unavailable, ODC gaps are not reported")
+
+        # Without ODC keys the state is not saved, the next run starts from
+        # the previous one
+        if incremental and odc is not None:
+            write_gap_state(
+                state_url,
+                SimpleNamespace(refreshed=refreshed, odc=odc),
+                landsat_s3,
+            )
+
     date_string = datetime.now().strftime("%Y-%m-%d")
+    yesterday = date.today() - timedelta(days=1)
+    exceeded = []
+
+    for satellite_group in satellite_groups:
+        group_satellites = satellite_group.split("_")
+        file_name = FILES[satellite_group]
+        title = " & ".join(group_satellites).replace("ls", "Landsat ")
+
+        log.info(f"Satellites {group_satellites}")
+        log.info(f"File Name {file_name}")
+
+        # Download bulk file, filtering keys from it while it is transferred
+        log.info("Download Bulk file and filtering keys from it")
+        with open_file_download(
+            url=str(BASE_BULK_CSV_URL), file_name=file_name
+        ) as bulk:
+            source_paths = get_and_filter_keys_from_files(bulk)
+
+        log.info(f"BULK FILE number of objects {len(source_paths)}")
+        log.info(f"BULK 10 First {list(source_paths)[0:10]}")
+
+        output_filename = "No missing scenes were found"
+
+        if update_stac:
+            log.info("FORCED UPDATE ACTIVE!")
+            missing_scenes = list(source_paths)
+            orphaned_scenes = []
+            missing_odc_scenes = []
+            orphaned_odc_scenes = []
+
+        else:
+            group_odc = (
+                None
+                if odc is None
+                else odc.filter(
+                    pc.match_substring_regex(
+                        odc.column("key"),
+                        "/("
+                        + "|".join(get_satellite_prefixes(group_satellites))
+                        + ")_",
+                    )
+                )
+            )
 
-    # Download bulk file
-    log.info("Download Bulk file")
-    file_path = download_file_to_tmp(url=str(BASE_BULK_CSV_URL), file_name=file_name)
+            log.info("Filtering missing and orphan scenes")
+            gaps = compute_gaps(
+                source_keys=source_paths,
+                destination_keys=filter_satellite_keys(dest_paths, group_satellites),
+                odc_keys=None if group_odc is None else group_odc.column("key"),
+                odc_indexed_times=(
+                    None if group_odc is None else group_odc.column("indexed_time")
+                ),
+                indexed_before=datetime.combine(yesterday, datetime.min.time()),
+            )
 
-    # Retrieve keys from the bulk file
-    log.info("Filtering keys from bulk file")
-    source_paths = get_and_filter_keys_from_files(file_path)
+            # collect missing scenes
+            # missing scenes = keys that are in the bulk file but missing in PDS sync bucket and/or in source bucket
+            missing_scenes = prefix_keys(gaps.missing, f"{USGS_S3_BUCKET_PATH}/")
 
-    log.info(f"BULK FILE number of objects {len(source_paths)}")
-    log.info(f"BULK 10 First {list(source_paths)[0:10]}")
+            # collect orphan scenes
+            # orphan scenes = keys that are in PDS sync bucket but missing in the bulk file and/or in source bucket
+            orphaned_scenes = prefix_keys(gaps.orphan, f"s3://{bucket_name}/")
 
-    output_filename = "No missing scenes were found"
+            missing_odc_scenes = prefix_keys(gaps.missing_odc, f"s3://{bucket_name}/")
 
-    if update_stac:
-        log.info("FORCED UPDATE ACTIVE!")
-        missing_scenes = source_paths
-        orphaned_scenes = []
+            orphaned_odc_scenes = prefix_keys(gaps.orphan_odc, f"s3://{bucket_name}/")
 
-    else:
-        # collect missing scenes
-        # missing scenes = keys that are in the bulk file but missing in PDS sync bucket and/or in source bucket
-        log.info("Filtering missing scenes")
-        missing_scenes = [
-            str(USGS_S3_BUCKET_PATH / path)
-            for path in source_paths.difference(dest_paths)
-        ]
-
-        # collect orphan scenes
-        # orphan scenes = keys that are in PDS sync bucket but missing in the bulk file and/or in source bucket
-        log.info("Filtering orphan scenes")
-        orphaned_scenes = [
-            str(URL(f"s3://{bucket_name}") / path)
-            for path in dest_paths.difference(source_paths)
-        ]
-
-        log.info("Retrieving keys from odc")
-        all_odc_values = get_odc_keys(satellites, log)
-        all_odc_keys = all_odc_values.keys()
-
-        missing_odc_scenes = [
-            str(URL(f"s3://{bucket_name}") / path)
-            for path in dest_paths.difference(all_odc_keys)
-        ]
-
-        yesterday = date.today() - timedelta(days=1)
-
-        orphaned_odc_scenes = [
-            str(URL(f"s3://{bucket_name}") / path)
-            for path in set(all_odc_keys).difference(dest_paths)
-            if yesterday > all_odc_values[path].date()
-        ]
-
-        log.info(f"Found {len(missing_scenes)} missing scenes")
-        log.info(f"missing_scenes 10 first keys {list(missing_scenes)[0:10]}")
-        log.info(f"Found {len(orphaned_scenes)} orphaned scenes")
-        log.info(f"orphaned_scenes 10 first keys {list(orphaned_scenes)[0:10]}")
-
-        log.info(f"Found {len(missing_odc_scenes)} missing ODC scenes")
-        log.info(f"missing_odc_scenes 10 first keys {list(missing_odc_scenes)[0:10]}")
-        log.info(f"Found {len(orphaned_odc_scenes)} orphaned ODC scenes")
-        log.info(f"orphaned_odc_scenes 10 first keys {list(orphaned_odc_scenes)[0:10]}")
-    landsat_s3 = s3_client(region_name="af-south-1")
-
-    if (
-        len(missing_scenes) > 0
-        or len(orphaned_scenes) > 0
-        or len(missing_odc_scenes) > 0
-        or len(orphaned_odc_scenes) > 0
-    ):
-        output_filename = (
-            (
-                f"{title}_{date_string}_gap_report.json"
-                if not update_stac
-                else URL(f"{date_string}_gap_report_update.json")
+            log.info(f"Found {len(missing_scenes)} missing scenes")
+            log.info(f"missing_scenes 10 first keys {missing_scenes[:10].to_pylist()}")
+            log.info(f"Found {len(orphaned_scenes)} orphaned scenes")
+            log.info(
+                f"orphaned_scenes 10 first keys {orphaned_scenes[:10].to_pylist()}"
             )
-            .replace(" ", "_")
-            .replace("_&", "")
-        )
 
-        log.info(
-            f"Report file will be saved in {landsat_status_report_path / output_filename}"
-        )
-        missing_orphan_scenes_json = json.dumps(
-            {
-                "orphan": orphaned_scenes,
-                "missing": missing_scenes,
-                "orphan_odc": orphaned_odc_scenes,
-                "missing_odc": missing_odc_scenes,
-            }
-        )
+            log.info(f"Found {len(missing_odc_scenes)} missing ODC scenes")
+            log.info(
+                f"missing_odc_scenes 10 first keys {missing_odc_scenes[:10].to_pylist()}"
+            )
+            log.info(f"Found {len(orphaned_odc_scenes)} orphaned ODC scenes")
+            log.info(
+                f"orphaned_odc_scenes 10 first keys {orphaned_odc_scenes[:10].to_pylist()}"
+            )
+
+        if (
+            len(missing_scenes) > 0
+            or len(orphaned_scenes) > 0
+            or len(missing_odc_scenes) > 0
+            or len(orphaned_odc_scenes) > 0
+        ):
+            # The satellites are part of the name so each group has its own report
+            output_filename = (
+                (
+                    f"{title}_{date_string}_gap_report.json"
+                    if not update_stac
+                    else f"{title}_{date_string}_gap_report_update.json"
+                )
+                .replace(" ", "_")
+                .replace("_&", "")
+            )
+
+            log.info(
+                f"Report file will be saved in {landsat_status_report_path / output_filename}"
+            )
+            write_gap_report(
+                report_path=str(landsat_status_report_path / output_filename),
+                report={
+                    "orphan": orphaned_scenes,
+                    "missing": missing_scenes,
+                    "orphan_odc": orphaned_odc_scenes,
+                    "missing_odc": missing_odc_scenes,
+                },
+                s3=landsat_s3,
+            )
 
-        s3_dump(
-            data=missing_orphan_scenes_json,
-            url=str(landsat_status_report_path / output_filename),
-            s3=landsat_s3,
-            ContentType="application/json",
+        report_output = (
+            str(landsat_status_report_url / output_filename)
+            if len(missing_scenes) > 0
+            or len(orphaned_scenes) > 0
+            or len(missing_odc_scenes) > 0
+            or len(orphaned_odc_scenes) > 0
+            else output_filename
         )
 
-    report_output = (
-        str(landsat_status_report_url / output_filename)
-        if len(missing_scenes) > 0
-        or len(orphaned_scenes) > 0
-        or len(missing_odc_scenes) > 0
-        or len(orphaned_odc_scenes) > 0
-        else output_filename
-    )
+        message = dedent(
+            f"*{title} GAP REPORT - {environment}*\n"
+            f"Missing Scenes: {len(missing_scenes)}\n"
+            f"Orphan Scenes: {len(orphaned_scenes)}\n"
+            f"Missing ODC Scenes: {len(missing_odc_scenes)}\n"
+            f"Orphan ODC Scenes: {len(orphaned_odc_scenes)}\n"
+            f"Report: {report_output}\n"
+        )
 
-    message = dedent(
-        f"*{title} GAP REPORT - {environment}*\n"
-        f"Missing Scenes: {len(missing_scenes)}\n"
-        f"Orphan Scenes: {len(orphaned_scenes)}\n"
-        f"Missing ODC Scenes: {len(missing_odc_scenes)}\n"
-        f"Orphan ODC Scenes: {len(orphaned_odc_scenes)}\n"
-        f"Report: {report_output}\n"
-    )
+        log.info(message)
 
-    log.info(message)
+        if not update_stac and (
+            len(missing_scenes) > 200 or len(orphaned_scenes) > 200
+        ):
+            if notification_url is not None:
+                send_slack_notification(
+                    notification_url, f"{group_satellites} Gap Report", message
+                )
+            exceeded.append(message)
 
     log.info(
-        f"File {file_name} processed and sent in {time_process(start=start_timer)}"
+        f"Files {[FILES[group] for group in satellite_groups]} processed and sent "
+        f"in {time_process(start=start_timer)}"
     )
 
-    if not update_stac and (len(missing_scenes) > 200 or len(orphaned_scenes) > 200):
-        if notification_url is not None:
-            send_slack_notification(
-                notification_url, f"{satellites} Gap Report", message
-            )
-        raise Exception(f"More than 200 scenes were found \n {message}")
+    if exceeded:
+        raise Exception(f"More than 200 scenes were found \n {''.join(exceeded)}")
 
 
 @click.argument(
@@ -339,25 +499,27 @@ def generate_buckets_diff(
     default="Bucket where the gap report is",
 )
 @click.argument(
-    "satellite",
-    type=str,
-    nargs=1,
+    "satellites",
+    type=click.Choice(SUPPORTED_SATELLITES),
+    nargs=-1,
     required=True,
-    default=f"Satellite to be compared, supported ones are {SUPPORTED_SATELLITES}",
 )
 @update_stac
+@incremental
 @slack_url
 @click.option("--version", is_flag=True, default=False)
 @click.command("landsat-gap-report")
 def cli(
     bucket_name: str,
-    satellite: str,
+    satellites: tuple[str, ...],
     update_stac: bool = False,
+    incremental: bool = False,
     slack_url: str = None,
     version: bool = False,
 ):
     """
-    Publish missing scenes
+    Publish missing scenes of one or more satellites, e.g. ls8_ls9 ls7 ls5.
+    With several satellites the inventory and ODC are read once for all.
     """
 
     if version:
@@ -365,8 +527,8 @@ def cli(
     else:
         generate_buckets_diff(
             bucket_name=bucket_name,
-            satellites=satellite.split("_"),
-            file_name=FILES.get(satellite, None),
+            satellite_groups=list(dict.fromkeys(satellites)),
             update_stac=update_stac,
             notification_url=slack_url,
+            incremental=incremental,
         )
@@ -1,6 +1,9 @@
 import json
 import logging
+import os
 import sys
+import time
+from functools import partial
 
 import boto3
 import botocore
@@ -13,17 +16,89 @@ from deafrica.click_options import limit, slack_url
 from deafrica.logs import setup_logging
 from deafrica.monitoring.gap_report import (
     find_latest_report,
-    read_report_missing_odc_scenes,
+    read_report_worker_scenes,
 )
-from deafrica.utils import split_list_equally
+from deafrica.utils import map_bounded
 
 S1_BUCKET = "s3://deafrica-sentinel-1/"
 S1_BUCKET_REGION = "af-south-1"
 S1_GAP_REPORT_DIR = str(URL(S1_BUCKET) / "status-report/")
 
+# SNS publish_batch takes up to 10 entries, batches are published by
+# SNS_PUBLISH_THREADS threads and failed entries retried SNS_PUBLISH_RETRIES
+# times, waiting SNS_RETRY_DELAY seconds doubled on every attempt
+SNS_BATCH_SIZE = 10
+SNS_PUBLISH_THREADS = int(os.getenv("SNS_PUBLISH_THREADS", "8"))
+SNS_PUBLISH_RETRIES = 3
+SNS_RETRY_DELAY = 0.5
+
 log = logging.getLogger(__name__)
 
 
+def get_message_payload(bucket_name: str, scene: str) -> dict:
+    return {
+        "Records": [{"s3": {"bucket": {"name": bucket_name}, "object": {"key": scene}}}]
+    }
+
+
+def publish_scenes_batch(
+    scenes: list[str],
+    sns_client,
+    sns_topic_arn: str,
+    bucket_name: str,
+    retries: int = SNS_PUBLISH_RETRIES,
+) -> list[str]:
+    """
+    Publish the messages of up to 10 scenes with one SNS publish_batch call.
+    Entries that fail on the SNS side are retried on their own, entries
+    rejected as invalid (sender fault) are not.
+    :param scenes:(list[str]) scene keys
+    :param sns_client: SNS client
+    :param sns_topic_arn:(str) topic the messages are published to
+    :param bucket_name:(str) bucket of the scenes
+    :param retries:(int) number of times failed entries are published again
+    :return:(list[str]) scenes that could not be published
+    """
+    pending = {str(entry_id): scene for entry_id, scene in enumerate(scenes)}
+    failed_tasks = []
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            time.sleep(SNS_RETRY_DELAY * 2 ** (attempt - 1))
+        try:
+            response = sns_client.publish_batch(
+                TopicArn=sns_topic_arn,
+                PublishBatchRequestEntries=[
+                    {
+                        "Id": entry_id,
+                        "Message": json.dumps(get_message_payload(bucket_name, scene)),
+                    }
+                    for entry_id, scene in pending.items()
+                ],
+            )
+        except botocore.exceptions.ClientError as error:
+            log.error(error)
+            continue
+
+        for entry in response.get("Successful", []):
+            log.info(
+                f"{entry['MessageId']} Success - SNS "
+                f"for {URL(S1_BUCKET) / pending[entry['Id']]} sent"
+            )
+        retry = {}
+        for entry in response.get("Failed", []):
+            scene = pending[entry["Id"]]
+            log.error(f"Failed to publish {scene}: {entry.get('Message')}")
+            if entry.get("SenderFault"):
+                failed_tasks.append(scene)
+            else:
+                retry[entry["Id"]] = scene
+        pending = retry
+        if not pending:
+            break
+
+    return failed_tasks + list(pending.values())
+
+
 @click.command("s1-gap-filler", no_args_is_help=True)
 @click.argument("worker-idx", type=int, nargs=1, required=True)
 @click.argument("max-workers", type=int, nargs=1, required=True)
@@ -68,50 +143,55 @@ def cli(
     log.info(f"Limited: {int(limit) if limit else 'No limit'}")
     log.info(f"Number of workers: {max_workers}")
 
-    files = read_report_missing_odc_scenes(report_path=latest_report, limit=limit)
-
-    log.info(f"Number of scenes found {len(files)}")
-    log.info(f"Example scenes: {files[0:10]}")
-
-    # Split scenes equally among the workers
-    split_list_scenes = split_list_equally(
-        list_to_split=files, num_inter_lists=int(max_workers)
+    # Read only the scenes of this worker, split equally among the workers
+    scenes, total = read_report_worker_scenes(
+        report_path=latest_report,
+        key="missing_odc",
+        idx=worker_idx,
+        max_workers=max_workers,
+        limit=limit,
     )
 
+    log.info(f"Number of scenes found {total}")
+    log.info(f"Example scenes: {scenes[0:10]}")
+
     # In case of the index being bigger than the number of positions in
     # the array, the extra POD isn' necessary
-    if len(split_list_scenes) <= worker_idx:
+    if not scenes:
         log.warning(f"Worker {worker_idx} Skipped!")
         sys.exit(0)
 
     log.info(f"Executing worker {worker_idx}")
 
-    scenes = split_list_scenes[worker_idx]
-
     log.info(f"Processing {len(scenes)}")
 
-    sns_client = boto3.client("sns", region_name=S1_BUCKET_REGION)
+    # A dry run reads the report and stops before publishing anything
+    if dryrun:
+        log.info(f"dryrun, {len(scenes)} messages not sent")
+        sys.exit(0)
+
+    sns_client = boto3.client(
+        "sns",
+        region_name=S1_BUCKET_REGION,
+        config=botocore.config.Config(max_pool_connections=SNS_PUBLISH_THREADS),
+    )
     bucket_name = s3_url_parse(S1_BUCKET)[0]
+    batches = [
+        scenes[start : start + SNS_BATCH_SIZE]
+        for start in range(0, len(scenes), SNS_BATCH_SIZE)
+    ]
     failed_tasks = []
-    for scene in scenes:
-        try:
-            message_payload = {
-                "Records": [
-                    {"s3": {"bucket": {"name": bucket_name}, "object": {"key": scene}}}
-                ]
-            }
-            response = sns_client.publish(
-                TopicArn=sns_topic_arn,
-                Message=json.dumps(message_payload),
-            )
-        except botocore.exceptions.ClientError as error:
-            log.error(error)
-            failed_tasks.append(scene)
-        else:
-            message_id = response["ResponseMetadata"]["RequestId"]
-            log.info(
-                f"{message_id} Success - SNS " f"for {URL(S1_BUCKET) / scene} sent"
-            )
+    for failed in map_bounded(
+        partial(
+            publish_scenes_batch,
+            sns_client=sns_client,
+            sns_topic_arn=sns_topic_arn,
+            bucket_name=bucket_name,
+        ),
+        batches,
+        n_threads=SNS_PUBLISH_THREADS,
+    ):
+        failed_tasks.extend(failed)
 
     if failed_tasks:
         raise RuntimeError(f"Failed to process the tasks: {', '.join(failed_tasks)}")
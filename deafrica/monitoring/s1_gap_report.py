@@ -2,22 +2,31 @@ import datetime
 import json
 import logging
 import os
+from pathlib import Path
 from textwrap import dedent
 
 import click
 import datacube
 import geopandas as gpd
 import pandas as pd
-import requests
+import pyarrow as pa
+import pyarrow.compute as pc
+import shapely
 from geojson import FeatureCollection
-from odc.aws import s3_client, s3_dump, s3_ls_dir
-from odc.aws.inventory import list_inventory
+from odc.aws import s3_client
 from sentinelhub import DataCollection, Geometry, SentinelHubCatalog, SHConfig
 from yarl import URL
 
 from deafrica.click_options import slack_url
+from deafrica.inventory import list_inventory_batches
 from deafrica.logs import setup_logging
-from deafrica.utils import AFRICA_EXTENT_URL, send_slack_notification
+from deafrica.monitoring.gap_report import write_gap_report
+from deafrica.utils import (
+    AFRICA_EXTENT_URL,
+    get_reference_file,
+    map_bounded,
+    send_slack_notification,
+)
 
 SH_CLIENT_ID = os.getenv("SH_CLIENT_ID", "")
 SH_CLIENT_SECRET = os.getenv("SH_CLIENT_SECRET", "")
@@ -30,6 +39,26 @@ S1_INVENTORY_PATH = "s3://deafrica-sentinel-1-inventory/deafrica-sentinel-1/deaf
 BASE_FOLDER_NAME = "s1_rtc"
 REGION_NAME = "af-south-1"
 
+# Files every s1_rtc dataset folder holds, named <dataset name>_<suffix>
+TARGET_FILE_SUFFIXES = (
+    "ANGLE.tif",
+    "AREA.tif",
+    "MASK.tif",
+    "metadata.json",
+    "metadata.xml",
+    "userdata.json",
+    "VH.tif",
+    "VV.tif",
+)
+
+# Local GeoParquet cache of the Sentinel Hub catalog results of each month,
+# months that closed less than S1_CATALOG_RECENT_DAYS ago are not cached as
+# scenes can still be added to them
+S1_CATALOG_CACHE_DIR = os.getenv("S1_CATALOG_CACHE_DIR", "/tmp/s1-catalog-cache")
+S1_CATALOG_RECENT_DAYS = int(os.getenv("S1_CATALOG_RECENT_DAYS", "60"))
+# Catalog searches run at the same time, kept low for the Sentinel Hub rate limits
+S1_CATALOG_THREADS = int(os.getenv("S1_CATALOG_THREADS", "4"))
+
 log = logging.getLogger(__name__)
 
 missing_datasets = []
@@ -38,18 +67,20 @@ incomplete_datatakes = []
 missing_files = []
 
 
-def get_origin_data(
-    grided_africa: gpd.GeoDataFrame,
-    africa_geometry: Geometry,
-    start_date: str,
-    end_date: str,
-) -> list[str]:
+def get_catalog() -> SentinelHubCatalog:
     config = SHConfig()
     config.sh_client_id = SH_CLIENT_ID
     config.sh_client_secret = SH_CLIENT_SECRET
 
-    catalog = SentinelHubCatalog(config=config)
+    return SentinelHubCatalog(config=config)
+
 
+def search_s1_scenes(
+    catalog: SentinelHubCatalog,
+    africa_geometry: Geometry,
+    start_date: str,
+    end_date: str,
+) -> gpd.GeoDataFrame:
     results = list(
         catalog.search(
             DataCollection.SENTINEL1_IW,
@@ -61,65 +92,164 @@ def get_origin_data(
             },
         )
     )
+    if not results:
+        return gpd.GeoDataFrame(
+            columns=["datetime", "filename", "geometry"],
+            geometry="geometry",
+            crs="EPSG:4326",
+        )
     # add id attribute to properties
     for row in results:
         props = row["properties"]
         props["filename"] = row["id"]
-    s1_results_frame = gpd.GeoDataFrame.from_features(results, crs="EPSG:4326")
+    return gpd.GeoDataFrame.from_features(results, crs="EPSG:4326")
 
-    grided_results = gpd.overlay(s1_results_frame, grided_africa, how="intersection")
-    grided_results = grided_results[
-        grided_results.geometry.to_crs("EPSG:3857").area > 0
-    ]
+
+def get_month_scenes(
+    catalog: SentinelHubCatalog,
+    africa_geometry: Geometry,
+    month_range: tuple[str],
+    cache_dir: str = S1_CATALOG_CACHE_DIR,
+) -> gpd.GeoDataFrame:
+    """
+    Search the Sentinel-1 scenes of a month, reading the months that closed
+    more than S1_CATALOG_RECENT_DAYS ago from a local GeoParquet cache
+    :param catalog:(SentinelHubCatalog) catalog client
+    :param africa_geometry:(Geometry) area to search
+    :param month_range:(tuple[str]) first and last day of the month
+    :param cache_dir:(str) cache folder, caching is disabled if not set
+    :return:(gpd.GeoDataFrame) scenes with filename, datetime and geometry
+    """
+    start_date, end_date = month_range
+    cache_path = (
+        Path(cache_dir) / f"{start_date}_{end_date}.parquet" if cache_dir else None
+    )
+    if cache_path is not None and cache_path.exists():
+        log.info(f"Reading cached S1 scenes from {cache_path}")
+        return gpd.read_parquet(cache_path)
+
+    scenes = search_s1_scenes(catalog, africa_geometry, start_date, end_date)
+
+    closed_before = datetime.datetime.today() - datetime.timedelta(
+        days=S1_CATALOG_RECENT_DAYS
+    )
+    if cache_path is not None and pd.to_datetime(end_date) < closed_before:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so a partial file is never read
+        partial_path = cache_path.with_suffix(f".{os.getpid()}.part")
+        scenes.to_parquet(partial_path)
+        partial_path.replace(cache_path)
+    return scenes
+
+
+def get_origin_data(
+    grided_africa: gpd.GeoDataFrame, s1_results_frame: gpd.GeoDataFrame
+) -> list[str]:
+    """
+    Dataset names of the grid cells the scenes overlap. The candidate pairs
+    come from the STRtree of the grid, and pairs that only share a boundary
+    are dropped, as their intersection has no area.
+    """
+    scene_index, grid_index = grided_africa.sindex.query(
+        s1_results_frame.geometry, predicate="intersects"
+    )
+    overlapping = ~shapely.touches(
+        s1_results_frame.geometry.values[scene_index],
+        grided_africa.geometry.values[grid_index],
+    )
+    grided_results = pd.DataFrame(
+        {
+            "filename": s1_results_frame["filename"].to_numpy()[scene_index],
+            "NAME": grided_africa["NAME"].to_numpy()[grid_index],
+        }
+    )[overlapping]
     return create_dataset_names(grided_results)
 
 
 def get_africa_grid(africa_extent_json: FeatureCollection) -> gpd.GeoDataFrame:
-    grid = gpd.read_file(TILING_GRID)
+    grid = gpd.read_file(get_reference_file(TILING_GRID))
     africa_extent_frame = gpd.GeoDataFrame.from_features(
         africa_extent_json["features"], crs="EPSG:4326"
     )
     return gpd.overlay(grid, africa_extent_frame, how="intersection")
 
 
-def create_dataset_names(grided_results):
-    datasets = []
-    for index, row in grided_results.iterrows():
-        split_id = row["filename"].split("_")
-        date = split_id[4][0:8]
-        data_take = split_id[7]
-        grid_name = row["NAME"]
-        dataset = (
-            "s1_rtc/"
-            + grid_name
-            + "/"
-            + date[0:4]
-            + "/"
-            + date[4:6]
-            + "/"
-            + date[6:8]
-            + "/"
-            + data_take
-        )
-        if dataset not in datasets:
-            datasets.append(dataset)
-    return datasets
+def create_dataset_names(grided_results: pd.DataFrame) -> list[str]:
+    split_id = grided_results["filename"].str.split("_")
+    date = split_id.str[4].str[0:8]
+    data_take = split_id.str[7]
+    datasets = (
+        "s1_rtc/"
+        + grided_results["NAME"]
+        + "/"
+        + date.str[0:4]
+        + "/"
+        + date.str[4:6]
+        + "/"
+        + date.str[6:8]
+        + "/"
+        + data_take
+    )
+    return list(pd.unique(datasets))
+
+
+def get_inventory_keys(contains: str = "") -> pa.ChunkedArray:
+    """
+    Read the s1_rtc keys from the latest inventory of the target bucket.
+    It's read once per report and shared by the ODC and target checks.
+    :param contains:(str) only keep the keys containing it, e.g. metadata.json
+    :return:(pa.ChunkedArray) keys
+    """
+    return pa.chunked_array(
+        [
+            batch.column("Key")
+            for batch in list_inventory_batches(
+                manifest=S1_INVENTORY_PATH,
+                prefix=BASE_FOLDER_NAME,
+                contains=contains,
+                n_threads=200,
+                columns=["Key"],
+            )
+        ],
+        pa.string(),
+    )
+
+
+def get_target_files(inventory_keys: pa.ChunkedArray) -> dict[str, set[str]]:
+    """
+    Group the target bucket keys by dataset folder,
+    e.g. s1_rtc/<grid>/<yyyy>/<mm>/<dd>/<datatake>.
+    :param inventory_keys:(pa.ChunkedArray) result of get_inventory_keys
+    :return:(dict) suffixes of the files found in each dataset folder
+    """
+    target_files = {}
+    for chunk in inventory_keys.chunks:
+        for key in chunk.to_pylist():
+            folder, _, file_name = key.rpartition("/")
+            target_files.setdefault(folder, set()).add(file_name.rsplit("_", 1)[-1])
+    return target_files
 
 
-def check_target_data(origin_datasets, target_datatakes):
-    client = s3_client(region_name=REGION_NAME)
-    target_files = []
+def check_target_data(
+    origin_datasets, target_datatakes: set, target_files: dict[str, set[str]]
+):
+    """
+    Check the datasets found in Sentinel Hub against the target bucket files
+    :param origin_datasets:(list) dataset folders expected in the target bucket
+    :param target_datatakes:(set) datatakes found in the target, updated in place
+    :param target_files:(dict) result of get_target_files
+    :return:(list) dataset folders found in the target
+    """
+    found_datasets = []
     for dataset in origin_datasets:
-        results = list(s3_ls_dir(uri=S1_BUCKET + dataset, s3=client))
-        if results:
-            target_files.append(results)
-            check_if_all_files_in_target_folder(results, dataset)
-            datatake = dataset[-6:]
-            if datatake not in target_datatakes:
-                target_datatakes.append(datatake)
+        suffixes = target_files.get(dataset)
+        if suffixes:
+            found_datasets.append(dataset)
+            check_if_all_files_in_target_folder(suffixes, dataset)
+            target_datatakes.add(dataset[-6:])
         else:
             missing_datasets.append(S1_BUCKET + dataset)
-    return target_files
+    return found_datasets
 
 
 def load_geometry_from_json(data: FeatureCollection) -> Geometry:
@@ -127,23 +257,10 @@ def load_geometry_from_json(data: FeatureCollection) -> Geometry:
         return Geometry.from_geojson(f["geometry"])
 
 
-def check_if_all_files_in_target_folder(name_list, name: str):
-    if not any("ANGLE.tif" in name for name in name_list):
-        missing_files.append(create_path_from_file(name) + "_ANGLE.tif")
-    if not any("AREA.tif" in name for name in name_list):
-        missing_files.append(create_path_from_file(name) + "_AREA.tif")
-    if not any("MASK.tif" in name for name in name_list):
-        missing_files.append(create_path_from_file(name) + "_MASK.tif")
-    if not any("metadata.json" in name for name in name_list):
-        missing_files.append(create_path_from_file(name) + "_metadata.json")
-    if not any("metadata.xml" in name for name in name_list):
-        missing_files.append(create_path_from_file(name) + "_metadata.xml")
-    if not any("userdata.json" in name for name in name_list):
-        missing_files.append(create_path_from_file(name) + "_userdata.json")
-    if not any("VH.tif" in name for name in name_list):
-        missing_files.append(create_path_from_file(name) + "_VH.tif")
-    if not any("VV.tif" in name for name in name_list):
-        missing_files.append(create_path_from_file(name) + "_VV.tif")
+def check_if_all_files_in_target_folder(suffixes: set[str], name: str):
+    for suffix in TARGET_FILE_SUFFIXES:
+        if suffix not in suffixes:
+            missing_files.append(create_path_from_file(name) + "_" + suffix)
 
 
 def create_path_from_file(path: str):
@@ -190,26 +307,42 @@ def get_s1_date_ranges() -> list[tuple[str]]:
     return date_ranges
 
 
-def find_missing_s1_data_from_sentinelhub() -> tuple[list, list, list, list]:
-    africa_extent_json = requests.get(AFRICA_EXTENT_URL).json()
+def find_missing_s1_data_from_sentinelhub(
+    inventory_keys: pa.ChunkedArray,
+) -> tuple[list, list, list, list]:
+    with open(get_reference_file(AFRICA_EXTENT_URL)) as f:
+        africa_extent_json = json.load(f)
     africa_geometry = load_geometry_from_json(africa_extent_json)
     africa_grid = get_africa_grid(africa_extent_json)
+    # Build the spatial index of the grid once, it's reused for every month
+    africa_grid.sindex
 
     date_ranges = get_s1_date_ranges()
 
-    target_datatakes = []
+    target_files = get_target_files(inventory_keys)
+
+    catalog = get_catalog()
+    month_scenes = dict(
+        map_bounded(
+            lambda month_range: (
+                month_range,
+                get_month_scenes(catalog, africa_geometry, month_range),
+            ),
+            date_ranges,
+            n_threads=S1_CATALOG_THREADS,
+        )
+    )
+
+    target_datatakes = set()
     for month_range in date_ranges:
         start_date = month_range[0]
-        end_date = month_range[-1]
         month_str = datetime.datetime.strptime(start_date, "%Y-%m-%d").strftime("%B %Y")
         log.info(f"Checking S1 data for the month {month_str}")
 
-        origin_data = get_origin_data(
-            africa_grid, africa_geometry, start_date, end_date
-        )
+        origin_data = get_origin_data(africa_grid, month_scenes.pop(month_range))
         log.info(f"Sentinel-Hub results: {len(origin_data)}")
 
-        target_data = check_target_data(origin_data, target_datatakes)
+        target_data = check_target_data(origin_data, target_datatakes, target_files)
         log.info(f"DEAfrica results: {len(target_data)}")
     if missing_datasets:
         for dataset in missing_datasets:
@@ -237,19 +370,17 @@ def get_odc_keys() -> dict[str, str]:
         raise
 
 
-def get_missing_and_orphan_odc_scenes() -> tuple[set[str], set[str]]:
+def get_missing_and_orphan_odc_scenes(
+    inventory_keys: pa.ChunkedArray,
+) -> tuple[set[str], set[str]]:
     log.info(f"Finding datasets in pds bucket {S1_BUCKET} but not indexed in ODC ...")
     today = datetime.datetime.today()
     # Keys that in the destination bucket but are not indexed
     # on ODC.
     destination_keys = set(
-        ns.Key
-        for ns in list_inventory(
-            manifest=S1_INVENTORY_PATH,
-            prefix=BASE_FOLDER_NAME,
-            contains="metadata.json",
-            n_threads=200,
-        )
+        inventory_keys.filter(
+            pc.match_substring(inventory_keys, "metadata.json")
+        ).to_pylist()
     )
     all_odc_values = get_odc_keys()
     indexed_keys = all_odc_values.keys()
@@ -273,11 +404,19 @@ def find_missing_s1_data(
     log = setup_logging()
     log.info("Task started ")
     try:
-        missing_odc_scenes, orphaned_odc_scenes = get_missing_and_orphan_odc_scenes()
+        # The target check needs every file, the ODC check only the metadata
+        log.info(f"Retrieving keys from inventory {S1_INVENTORY_PATH}")
+        inventory_keys = get_inventory_keys(
+            contains="metadata.json" if skip_sentinelhub_check else ""
+        )
+
+        missing_odc_scenes, orphaned_odc_scenes = get_missing_and_orphan_odc_scenes(
+            inventory_keys
+        )
 
         if skip_sentinelhub_check is False:
             missing_datasets, missing_files, incomplete_datatakes, missing_datatakes = (
-                find_missing_s1_data_from_sentinelhub()
+                find_missing_s1_data_from_sentinelhub(inventory_keys)
             )
 
         log.info("Writing gap report ...")
@@ -287,30 +426,25 @@ def find_missing_s1_data(
         log.info(f"File will be saved in {s1_status_report_path}{output_filename}")
 
         if skip_sentinelhub_check is False:
-            gap_report_json = json.dumps(
-                {
-                    "missing_datasets": list(missing_datasets),
-                    "missing_files": list(missing_files),
-                    "incomplete_datatakes": list(incomplete_datatakes),
-                    "missing_datatakes": list(missing_datatakes),
-                    "missing_odc": list(missing_odc_scenes),
-                    "orphan_odc": list(orphaned_odc_scenes),
-                }
-            )
+            gap_report = {
+                "missing_datasets": list(missing_datasets),
+                "missing_files": list(missing_files),
+                "incomplete_datatakes": list(incomplete_datatakes),
+                "missing_datatakes": list(missing_datatakes),
+                "missing_odc": list(missing_odc_scenes),
+                "orphan_odc": list(orphaned_odc_scenes),
+            }
         else:
-            gap_report_json = json.dumps(
-                {
-                    "missing_odc": list(missing_odc_scenes),
-                    "orphan_odc": list(orphaned_odc_scenes),
-                }
-            )
+            gap_report = {
+                "missing_odc": list(missing_odc_scenes),
+                "orphan_odc": list(orphaned_odc_scenes),
+            }
 
         client = s3_client(region_name=REGION_NAME)
-        s3_dump(
-            data=gap_report_json,
-            url=str(s1_status_report_path / output_filename),
+        write_gap_report(
+            report_path=str(s1_status_report_path / output_filename),
+            report=gap_report,
             s3=client,
-            ContentType="application/json",
         )
         log.info(f"Gap report written to {s1_status_report_path}{output_filename}")
 
@@ -14,11 +14,10 @@ from deafrica.click_options import limit, slack_url
 from deafrica.logs import setup_logging
 from deafrica.monitoring.gap_report import (
     find_latest_report,
-    read_report_missing_scenes,
+    read_report_worker_scenes,
 )
 from deafrica.utils import (
     send_slack_notification,
-    split_list_equally,
 )
 
 SOURCE_REGION = "us-west-2"
@@ -183,25 +182,27 @@ def send_messages(
     log.info(f"Limited: {int(limit) if limit else 'No limit'}")
     log.info(f"Number of workers: {max_workers}")
 
-    files = read_report_missing_scenes(report_path=latest_report, limit=limit)
-
-    log.info(f"Number of scenes found {len(files)}")
-    log.info(f"Example scenes: {files[0:10]}")
-
-    # Split scenes equally among the workers
-    split_list_scenes = split_list_equally(
-        list_to_split=files, num_inter_lists=int(max_workers)
+    # Read only the scenes of this worker, split equally among the workers
+    scene_paths, total = read_report_worker_scenes(
+        report_path=latest_report,
+        key="missing",
+        idx=idx,
+        max_workers=max_workers,
+        limit=limit,
     )
 
+    log.info(f"Number of scenes found {total}")
+    log.info(f"Example scenes: {scene_paths[0:10]}")
+
     # In case of the index being bigger than the number of positions in the array, the extra POD isn' necessary
-    if len(split_list_scenes) <= idx:
+    if not scene_paths:
         log.warning(f"Worker {idx} Skipped!")
         sys.exit(0)
 
     log.info(f"Executing worker {idx}")
 
     messages = prepare_message(
-        scene_paths=split_list_scenes[idx], product_name=product_name, log=log
+        scene_paths=scene_paths, product_name=product_name, log=log
     )
 
     queue = get_queue(queue_name=queue_name)
@@ -233,9 +234,9 @@ def send_messages(
 
     message = dedent(
         f"{error_flag}*Sentinel 2 GAP Filler (worker {idx}) - {environment}*\n"
-        f"Total messages: {len(files)}\n"
-        f"Attempted worker messages prepared: {len(split_list_scenes[idx])}\n"
-        f"Failed messages prepared: {len(split_list_scenes[idx]) - sent}\n"
+        f"Total messages: {total}\n"
+        f"Attempted worker messages prepared: {len(scene_paths)}\n"
+        f"Failed messages prepared: {len(scene_paths) - sent}\n"
         f"Sent Messages: {sent}\n"
         f"Failed Messages: {failed}\n"
     )
@@ -1,18 +1,37 @@
-import json
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from textwrap import dedent
+from types import SimpleNamespace
+from typing import Optional
 
 import click
 import datacube
 import pandas as pd
-from odc.aws import s3_client, s3_dump
+import pyarrow as pa
+import pyarrow.compute as pc
+from odc.aws import s3_client
 from yarl import URL
 
 from deafrica import __version__
-from deafrica.click_options import slack_url, update_stac
-from deafrica.inventory import list_inventory
+from deafrica.click_options import incremental, slack_url, update_stac
+from deafrica.inventory import (
+    find_latest_manifest,
+    list_inventory_batches,
+)
 from deafrica.logs import setup_logging
+from deafrica.monitoring.gap_report import (
+    GAP_STATE_FOLDER,
+    apply_odc_delta,
+    compute_gaps,
+    export_odc_uris,
+    get_watermark,
+    odc_uris_to_keys,
+    prefix_keys,
+    read_gap_state,
+    write_gap_report,
+    write_gap_state,
+)
 from deafrica.utils import (
+    get_reference_file,
     send_slack_notification,
 )
 
@@ -27,60 +46,93 @@ SOURCE_REGION = "us-west-2"
 BASE_FOLDER_NAME = "sentinel-2-c1-l2a"
 
 
-def get_and_filter_cogs_keys():
-    """
-    Retrieve key list from a inventory bucket and filter
-    :return:
-    """
-
-    s3 = s3_client(region_name=SOURCE_REGION)
-    source_keys = list_inventory(
-        manifest=f"{SOURCE_INVENTORY_PATH}",
-        s3=s3,
-        prefix=BASE_FOLDER_NAME,
-        contains=".json",
-        n_threads=200,
-    )
-
-    africa_tile_ids = set(
+def get_africa_tile_ids() -> set:
+    return set(
         pd.read_csv(
-            "https://raw.githubusercontent.com/digitalearthafrica/deafrica-extent/master/deafrica-mgrs-tiles.csv.gz",
+            get_reference_file(
+                "https://raw.githubusercontent.com/digitalearthafrica/deafrica-extent/master/deafrica-mgrs-tiles.csv.gz"
+            ),
             header=None,
         ).values.ravel()
     )
 
-    return set(
-        key.key
-        for key in source_keys
-        if (
-            key.key.split("/")[-2].split("_")[1].lstrip("T") in africa_tile_ids
-            and "tileinfo_metadata.json" not in key.key
-            and "tileInfo.json" not in key.key
+
+def filter_cogs_keys(keys: pa.Array, africa_tile_ids: pa.Array) -> pa.Array:
+    """
+    Keep the keys of the STAC documents of African scenes. The tile id is the
+    second field of the scene folder, without its T, e.g. 35PKS in
+    S2A_T35PKS_20230603T082601_L2A.
+    """
+    tile_ids = pc.extract_regex(
+        keys, pattern=r"(?:^|/)[^/_]*_T*(?P<tile>[^/_]*)[^/]*/[^/]*$"
+    ).field("tile")
+    excluded = pc.match_substring_regex(
+        keys, pattern=r"tileinfo_metadata\.json|tileInfo\.json"
+    )
+    return keys.filter(
+        pc.and_(pc.is_in(tile_ids, value_set=africa_tile_ids), pc.invert(excluded))
+    )
+
+
+def get_and_filter_cogs_keys(manifest: str = None) -> pa.Array:
+    """
+    Retrieve key list from a inventory bucket and filter
+    :param manifest: (str) source inventory manifest, defaults to the latest
+    :return:(pa.Array) unique keys
+    """
+
+    s3 = s3_client(region_name=SOURCE_REGION, max_pool_connections=200)
+    africa_tile_ids = pa.array(list(get_africa_tile_ids()), pa.string())
+
+    # Each batch is filtered as it's read, the keys stay in Arrow
+    chunks = [
+        filter_cogs_keys(batch.column("Key"), africa_tile_ids)
+        for batch in list_inventory_batches(
+            manifest=manifest or f"{SOURCE_INVENTORY_PATH}",
+            s3=s3,
+            prefix=BASE_FOLDER_NAME,
+            contains=".json",
+            n_threads=200,
+            columns=["Key"],
         )
+    ]
+    return pc.unique(pa.chunked_array(chunks, pa.string()))
+
+
+def get_destination_keys(manifest: str, s3) -> pa.ChunkedArray:
+    return pa.chunked_array(
+        [
+            batch.column("Key")
+            for batch in list_inventory_batches(
+                manifest=manifest,
+                s3=s3,
+                prefix=BASE_FOLDER_NAME,
+                contains=".json",
+                n_threads=200,
+                columns=["Key"],
+            )
+        ],
+        pa.string(),
     )
 
 
-def get_odc_keys(log) -> set:
+def get_odc_keys(log, indexed_after: datetime = None) -> Optional[pa.Table]:
     try:
         dc = datacube.Datacube()
-        all_odc_vals = {}
-
-        for val in dc.index.datasets.search_returning(
-            ["uri", "indexed_time"], product="s2_l2a_c1"
-        ):
-            all_odc_vals[val.uri.replace("s3://deafrica-sentinel-2-l2a-c1/", "")] = (
-                val.indexed_time
-            )
-        return all_odc_vals
+        uris = export_odc_uris(dc, ["s2_l2a_c1"], indexed_after=indexed_after)
+        return odc_uris_to_keys(uris, "s3://deafrica-sentinel-2-l2a-c1/")
     except Exception:
-        log.info("Error while searching for datasets in odc")
-        return {}
+        # An empty table would report every scene as not indexed, the
+        # ODC gaps are left out of the report instead
+        log.exception("Error while searching for datasets in odc")
+        return None
 
 
 def generate_buckets_diff(
     bucket_name: str,
     update_stac: bool = False,
     notification_url: str = None,
+    incremental: bool = False,
 ) -> None:
     """
     Compare Sentinel-2-c1 buckets in US and Africa and detect differences
@@ -88,6 +140,7 @@ def generate_buckets_diff(
     :param bucket_name: (str) Bucket where the gap report is
     :param update_stac: (bool) Define if the report will contain all scenes from the source for an update
     :param notification_url: (str) Optional slack URL in case of you want to send a slack notification
+    :param incremental: (bool) Start from the ODC keys saved by the last incremental report and only query datasets indexed since
     """
 
     log = setup_logging()
@@ -102,55 +155,83 @@ def generate_buckets_diff(
 
     date_string = datetime.now().strftime("%Y-%m-%d")
 
-    # Retrieve keys from inventory bucket
-    source_keys = get_and_filter_cogs_keys()
+    s2_s3 = s3_client(region_name=SENTINEL_2_C1_REGION, max_pool_connections=200)
 
     output_filename = "No missing scenes were found"
 
     if update_stac:
         log.info("FORCED UPDATE ACTIVE!")
-        missing_scenes = set(
-            f"s3://e84-earth-search-sentinel-data/{key}" for key in source_keys
+        # Retrieve keys from inventory bucket
+        source_keys = get_and_filter_cogs_keys()
+        missing_scenes = prefix_keys(
+            source_keys, "s3://e84-earth-search-sentinel-data/"
         )
-        orphaned_keys = set()
+        orphaned_keys = []
+        missing_odc_scenes = []
+        orphaned_odc_scenes = []
+        indexed_keys = {}
 
     else:
-        destination_keys = set(
-            ns.Key
-            for ns in list_inventory(
-                manifest=f"{SENTINEL_2_C1_INVENTORY_PATH}",
-                prefix=BASE_FOLDER_NAME,
-                contains=".json",
-                n_threads=200,
-            )
+        source_s3 = s3_client(region_name=SOURCE_REGION, max_pool_connections=200)
+        source_manifest = find_latest_manifest(f"{SOURCE_INVENTORY_PATH}", source_s3)
+        destination_manifest = find_latest_manifest(
+            f"{SENTINEL_2_C1_INVENTORY_PATH}", s2_s3
         )
+        state_url = str(s2_c1_status_report_path / GAP_STATE_FOLDER)
+        state = read_gap_state(state_url, s2_s3) if incremental else None
+
+        # The inventories are rewritten daily and always read in full, an
+        # incremental report only queries the ODC datasets indexed since the
+        # last one
+        source_keys = get_and_filter_cogs_keys(manifest=source_manifest)
+        destination_keys = get_destination_keys(destination_manifest, s2_s3)
+
+        if state is None:
+            log.info("Retrieving keys from odc")
+            odc = get_odc_keys(log)
+            refreshed = datetime.now(timezone.utc)
+        else:
+            watermark = get_watermark(state.odc)
+            log.info(f"Retrieving keys from odc indexed after {watermark}")
+            odc = get_odc_keys(log, indexed_after=watermark)
+            if odc is not None:
+                odc = apply_odc_delta(state.odc, odc)
+            refreshed = state.refreshed
+
+        if odc is None:
+            log.error("ODC keys unavailable, ODC gaps are not reported")
+        indexed_keys = [] if odc is None else odc.column("key")
 
-        log.info("Retrieving keys from odc")
-        all_odc_values = get_odc_keys(log)
-        indexed_keys = all_odc_values.keys()
+        yesterday = date.today() - timedelta(days=1)
 
-        # Keys that are missing, they are in the source but not in the bucket
-        missing_scenes = set(
-            f"s3://e84-earth-search-sentinel-data/{key}"
-            for key in source_keys
-            if key not in destination_keys
+        gaps = compute_gaps(
+            source_keys=source_keys,
+            destination_keys=destination_keys,
+            odc_keys=None if odc is None else indexed_keys,
+            odc_indexed_times=None if odc is None else odc.column("indexed_time"),
+            indexed_before=datetime.combine(yesterday, datetime.min.time()),
         )
 
-        # Keys that are lost, they are in the bucket but not found in the source
-        orphaned_keys = destination_keys.difference(source_keys)
+        # Without ODC keys the state is not saved, the next run starts from
+        # the previous one
+        if incremental and odc is not None:
+            write_gap_state(
+                state_url,
+                SimpleNamespace(refreshed=refreshed, odc=odc),
+                s2_s3,
+            )
 
-        missing_odc_scenes = set(
-            key for key in destination_keys if key not in indexed_keys
+        # Keys that are missing, they are in the source but not in the bucket
+        missing_scenes = prefix_keys(
+            gaps.missing, "s3://e84-earth-search-sentinel-data/"
         )
 
-        yesterday = date.today() - timedelta(days=1)
+        # Keys that are lost, they are in the bucket but not found in the source
+        orphaned_keys = gaps.orphan
 
-        orphaned_odc_scenes = set(
-            key
-            for key in indexed_keys
-            if (key not in destination_keys and yesterday > all_odc_values[key].date())
-        )
-    s2_s3 = s3_client(region_name=SENTINEL_2_C1_REGION)
+        missing_odc_scenes = gaps.missing_odc
+
+        orphaned_odc_scenes = gaps.orphan_odc
 
     if (
         len(missing_scenes) > 0
@@ -166,20 +247,15 @@ def generate_buckets_diff(
 
         log.info(f"File will be saved in {s2_c1_status_report_path}/{output_filename}")
 
-        missing_orphan_scenes_json = json.dumps(
-            {
-                "orphan": list(orphaned_keys),
-                "missing": list(missing_scenes),
-                "orphan_odc": list(orphaned_odc_scenes),
-                "missing_odc": list(missing_odc_scenes),
-            }
-        )
-
-        s3_dump(
-            data=missing_orphan_scenes_json,
-            url=str(URL(s2_c1_status_report_path) / output_filename),
+        write_gap_report(
+            report_path=str(URL(s2_c1_status_report_path) / output_filename),
+            report={
+                "orphan": orphaned_keys,
+                "missing": missing_scenes,
+                "orphan_odc": orphaned_odc_scenes,
+                "missing_odc": missing_odc_scenes,
+            },
             s3=s2_s3,
-            ContentType="application/json",
         )
     report_http_link = (
         f"https://{bucket_name}.s3.{SENTINEL_2_C1_REGION}.amazonaws.com/status-report/{output_filename}"
@@ -229,12 +305,14 @@ def generate_buckets_diff(
     default="Bucket where the gap report is",
 )
 @update_stac
+@incremental
 @slack_url
 @click.option("--version", is_flag=True, default=False)
 @click.command("s2-c1-gap-report")
 def cli(
     bucket_name: str,
     update_stac: bool = False,
+    incremental: bool = False,
     slack_url: str = None,
     version: bool = False,
 ):
@@ -246,5 +324,8 @@ def cli(
         click.echo(__version__)
 
     generate_buckets_diff(
-        bucket_name=bucket_name, update_stac=update_stac, notification_url=slack_url
+        bucket_name=bucket_name,
+        update_stac=update_stac,
+        notification_url=slack_url,
+        incremental=incremental,
     )
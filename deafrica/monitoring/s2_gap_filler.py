@@ -22,17 +22,20 @@ from deafrica.click_options import limit, slack_url
 from deafrica.logs import setup_logging
 from deafrica.monitoring.gap_report import (
     find_latest_report,
-    read_report_missing_scenes,
+    read_report_worker_scenes,
 )
 from deafrica.utils import (
+    map_bounded,
     send_slack_notification,
-    split_list_equally,
 )
 
 SOURCE_REGION = "us-west-2"
 S3_BUCKET_PATH = "s3://deafrica-sentinel-2/status-report/"
 STAC_VERSION = "1.0.0-beta.2"
 
+# Scenes whose messages are prepared at the same time
+PREPARE_MESSAGE_THREADS = int(os.getenv("PREPARE_MESSAGE_THREADS", "16"))
+
 # supress a FutureWarning from pyproj
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
@@ -373,8 +376,38 @@ def prepare_s2_l2a_stac(src_stac_doc: Dict):
     return new_stac_doc
 
 
+def prepare_scene_message(s3_path: str, product_name: str, s3) -> Dict:
+    """
+    Recreate the STAC document of one scene and return the SNS message
+    with it as payload, as described in prepare_message.
+    """
+    # read the provided STAC document
+    contents = s3_fetch(url=s3_path, s3=s3)
+    src_stac_doc = json.loads(contents)
+
+    # Handle formatting shifting changes from upstream metadata and collections,
+    # so they can be transformed into a STAC document along with message attributes
+    # for the SNS message, to be indexed into a consistent DEAfrica product.
+    if product_name == "s2_l2a":
+        stac_metadata = prepare_s2_l2a_stac(src_stac_doc)
+        attributes = get_common_message_attributes(stac_metadata, product_name)
+
+    if product_name == "s2_l2a_c1":
+        # TODO something different will need to be done here
+        raise RuntimeError("s2_l2a_c1 (collection 1) logic is not yet supported")
+        # attributes = get_common_message_attributes(src_stac_doc, product_name)
+
+    return {
+        "Message": json.dumps(stac_metadata),
+        "MessageAttributes": attributes,
+    }
+
+
 def prepare_message(
-    scene_paths: list, product_name: str, log: Optional[logging.Logger] = None
+    scene_paths: list,
+    product_name: str,
+    log: Optional[logging.Logger] = None,
+    n_threads: int = PREPARE_MESSAGE_THREADS,
 ):
     """
     Prepare a single message for each STAC file. The upstream source STAC JSON
@@ -389,6 +422,10 @@ def prepare_message(
     incorrect data in the provided STAC file. E.g. the AOT.tif shape/transform
     provided is incorrect.
 
+    These requests are latency bound, so n_threads scenes are prepared at
+    the same time. Messages are yielded as soon as they are ready, not in
+    the order of scene_paths, and at most n_threads are pending at once.
+
     raises:
         RuntimeError if collection 1 data is passed. Logic does not yet exist.
 
@@ -396,45 +433,23 @@ def prepare_message(
         message: SNS message with STAC document as payload.
     """
 
-    s3 = s3_client(region_name=SOURCE_REGION)
+    s3 = s3_client(region_name=SOURCE_REGION, max_pool_connections=n_threads)
 
-    message_id = 0
-    for s3_path in scene_paths:
+    def prepare(s3_path: str) -> Optional[Dict]:
         try:
-            # read the provided STAC document
-            contents = s3_fetch(url=s3_path, s3=s3)
-            src_stac_doc = json.loads(contents)
-
-            # Handle formatting shifting changes from upstream metadata and collections,
-            # so they can be transformed into a STAC document along with message attributes
-            # for the SNS message, to be indexed into a consistent DEAfrica product.
-            if product_name == "s2_l2a":
-                stac_metadata = prepare_s2_l2a_stac(src_stac_doc)
-                attributes = get_common_message_attributes(stac_metadata, product_name)
-
-            if product_name == "s2_l2a_c1":
-                # TODO something different will need to be done here
-                raise RuntimeError(
-                    "s2_l2a_c1 (collection 1) logic is not yet supported"
-                )
-                # attributes = get_common_message_attributes(src_stac_doc, product_name)
-
-            message = {
-                "Id": str(message_id),
-                "MessageBody": json.dumps(
-                    {
-                        "Message": json.dumps(stac_metadata),
-                        "MessageAttributes": attributes,
-                    }
-                ),
-            }
-            message_id += 1
-            yield message
+            return prepare_scene_message(s3_path, product_name, s3)
         except Exception as exc:
             if log:
                 log.error(f"Error generating message for : {s3_path}")
                 log.error(f"{exc}")
 
+    message_id = 0
+    for message_body in map_bounded(prepare, scene_paths, n_threads=n_threads):
+        if message_body is None:
+            continue
+        yield {"Id": str(message_id), "MessageBody": json.dumps(message_body)}
+        message_id += 1
+
 
 def send_messages(
     idx: int,
@@ -480,25 +495,27 @@ def send_messages(
     log.info(f"Limited: {int(limit) if limit else 'No limit'}")
     log.info(f"Number of workers: {max_workers}")
 
-    files = read_report_missing_scenes(report_path=latest_report, limit=limit)
-
-    log.info(f"Number of scenes found {len(files)}")
-    log.info(f"Example scenes: {files[0:10]}")
-
-    # Split scenes equally among the workers
-    split_list_scenes = split_list_equally(
-        list_to_split=files, num_inter_lists=int(max_workers)
+    # Read only the scenes of this worker, split equally among the workers
+    scene_paths, total = read_report_worker_scenes(
+        report_path=latest_report,
+        key="missing",
+        idx=idx,
+        max_workers=max_workers,
+        limit=limit,
     )
 
+    log.info(f"Number of scenes found {total}")
+    log.info(f"Example scenes: {scene_paths[0:10]}")
+
     # In case of the index being bigger than the number of positions in the array, the extra POD isn' necessary
-    if len(split_list_scenes) <= idx:
+    if not scene_paths:
         log.warning(f"Worker {idx} Skipped!")
         sys.exit(0)
 
     log.info(f"Executing worker {idx}")
 
     messages = prepare_message(
-        scene_paths=split_list_scenes[idx], product_name=product_name, log=log
+        scene_paths=scene_paths, product_name=product_name, log=log
     )
 
     queue = get_queue(queue_name=queue_name)
@@ -530,9 +547,9 @@ def send_messages(
 
     message = dedent(
         f"{error_flag}*Sentinel 2 GAP Filler (worker {idx}) - {environment}*\n"
-        f"Total messages: {len(files)}\n"
-        f"Attempted worker messages prepared: {len(split_list_scenes[idx])}\n"
-        f"Failed messages prepared: {len(split_list_scenes[idx]) - sent}\n"
+        f"Total messages: {total}\n"
+        f"Attempted worker messages prepared: {len(scene_paths)}\n"
+        f"Failed messages prepared: {len(scene_paths) - sent}\n"
         f"Sent Messages: {sent}\n"
         f"Failed Messages: {failed}\n"
     )
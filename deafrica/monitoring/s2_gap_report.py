@@ -1,19 +1,39 @@
-import json
-import re
-from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
 from textwrap import dedent
+from types import SimpleNamespace
+from typing import Optional
 
 import click
 import datacube
 import pandas as pd
-from odc.aws import s3_client, s3_dump
-from odc.aws.inventory import list_inventory
+import pyarrow as pa
+import pyarrow.compute as pc
+from odc.aws import s3_client
 from yarl import URL
 
 from deafrica import __version__
-from deafrica.click_options import slack_url, update_stac
+from deafrica.click_options import incremental, slack_url, update_stac
+from deafrica.inventory import (
+    find_latest_manifest,
+    list_inventory_batches,
+)
 from deafrica.logs import setup_logging
+from deafrica.monitoring.gap_report import (
+    GAP_STATE_FOLDER,
+    ODC_EXPORT_PARTITIONS,
+    apply_odc_delta,
+    compute_gaps,
+    export_odc_uris,
+    get_watermark,
+    odc_uris_to_keys,
+    prefix_keys,
+    read_gap_state,
+    write_gap_report,
+    write_gap_state,
+)
 from deafrica.utils import (
+    get_reference_file,
     send_slack_notification,
 )
 
@@ -26,61 +46,100 @@ SOURCE_REGION = "us-west-2"
 BASE_FOLDER_NAME = "sentinel-s2-l2a-cogs"
 
 
-def get_and_filter_cogs_keys():
-    """
-    Retrieve key list from a inventory bucket and filter
-    :return:
-    """
-
-    s3 = s3_client(region_name=SOURCE_REGION)
-    source_keys = list_inventory(
-        manifest=f"{SOURCE_INVENTORY_PATH}",
-        s3=s3,
-        prefix=BASE_FOLDER_NAME,
-        contains=".json",
-        n_threads=200,
-    )
-
-    africa_tile_ids = set(
+def get_africa_tile_ids() -> set:
+    return set(
         pd.read_csv(
-            "https://raw.githubusercontent.com/digitalearthafrica/deafrica-extent/master/deafrica-mgrs-tiles.csv.gz",
+            get_reference_file(
+                "https://raw.githubusercontent.com/digitalearthafrica/deafrica-extent/master/deafrica-mgrs-tiles.csv.gz"
+            ),
             header=None,
         ).values.ravel()
     )
 
-    return set(
-        key.Key
-        for key in source_keys
-        if (
-            key.Key.split("/")[-2].split("_")[1] in africa_tile_ids
-            # We need to ensure we're ignoring the old format data
-            and re.match(r"sentinel-s2-l2a-cogs/\d{4}/", key.Key) is None
-            and "tileinfo_metadata.json" not in key.Key
+
+def filter_cogs_keys(keys: pa.Array, africa_tile_ids: pa.Array) -> pa.Array:
+    """
+    Keep the keys of the STAC documents of African scenes. The tile id is the
+    second field of the scene folder, e.g. 35PKS in S2A_35PKS_20230603_0_L2A.
+    """
+    tile_ids = pc.extract_regex(
+        keys, pattern=r"(?:^|/)[^/_]*_(?P<tile>[^/_]*)[^/]*/[^/]*$"
+    ).field("tile")
+    excluded = pc.match_substring_regex(
+        # We need to ensure we're ignoring the old format data
+        keys,
+        pattern=r"^sentinel-s2-l2a-cogs/\d{4}/|tileinfo_metadata\.json",
+    )
+    return keys.filter(
+        pc.and_(pc.is_in(tile_ids, value_set=africa_tile_ids), pc.invert(excluded))
+    )
+
+
+def get_and_filter_cogs_keys(manifest: str = None, n_threads: int = 200) -> pa.Array:
+    """
+    Retrieve key list from a inventory bucket and filter
+    :param manifest: (str) source inventory manifest, defaults to the latest
+    :param n_threads: (int) threads and S3 connections used to read the inventory
+    :return:(pa.Array) unique keys
+    """
+
+    s3 = s3_client(region_name=SOURCE_REGION, max_pool_connections=n_threads)
+    africa_tile_ids = pa.array(list(get_africa_tile_ids()), pa.string())
+
+    # Each batch is filtered as it's read, the keys stay in Arrow
+    chunks = [
+        filter_cogs_keys(batch.column("Key"), africa_tile_ids)
+        for batch in list_inventory_batches(
+            manifest=manifest or f"{SOURCE_INVENTORY_PATH}",
+            s3=s3,
+            prefix=BASE_FOLDER_NAME,
+            contains=".json",
+            n_threads=n_threads,
+            columns=["Key"],
         )
+    ]
+    return pc.unique(pa.chunked_array(chunks, pa.string()))
+
+
+def get_destination_keys(manifest: str, s3, n_threads: int = 200) -> pa.ChunkedArray:
+    return pa.chunked_array(
+        [
+            batch.column("Key")
+            for batch in list_inventory_batches(
+                manifest=manifest,
+                s3=s3,
+                prefix=BASE_FOLDER_NAME,
+                contains=".json",
+                n_threads=n_threads,
+                columns=["Key"],
+            )
+        ],
+        pa.string(),
     )
 
 
-def get_odc_keys(log) -> set:
+def get_odc_keys(
+    log, indexed_after: datetime = None, n_threads: int = ODC_EXPORT_PARTITIONS
+) -> Optional[pa.Table]:
     try:
         dc = datacube.Datacube()
-        all_odc_vals = {}
-
-        for val in dc.index.datasets.search_returning(
-            ["uri", "indexed_time"], product="s2_l2a"
-        ):
-            all_odc_vals[val.uri.replace("s3://deafrica-sentinel-2/", "")] = (
-                val.indexed_time
-            )
-        return all_odc_vals
+        uris = export_odc_uris(
+            dc, ["s2_l2a"], indexed_after=indexed_after, n_partitions=n_threads
+        )
+        return odc_uris_to_keys(uris, "s3://deafrica-sentinel-2/")
     except Exception:
-        log.info("Error while searching for datasets in odc")
-        return {}
+        # An empty table would report every scene as not indexed, the
+        # ODC gaps are left out of the report instead
+        log.exception("Error while searching for datasets in odc")
+        return None
 
 
 def generate_buckets_diff(
     bucket_name: str,
     update_stac: bool = False,
     notification_url: str = None,
+    incremental: bool = False,
+    max_threads: int = 200,
 ) -> None:
     """
     Compare Sentinel-2 buckets in US and Africa and detect differences
@@ -88,6 +147,8 @@ def generate_buckets_diff(
     :param bucket_name: (str) Bucket where the gap report is
     :param update_stac: (bool) Define if the report will contain all scenes from the source for an update
     :param notification_url: (str) Optional slack URL in case of you want to send a slack notification
+    :param incremental: (bool) Start from the ODC keys saved by the last incremental report and only query datasets indexed since
+    :param max_threads: (int) Total threads and S3 connections shared by the source inventory, destination inventory and ODC stages
     """
 
     log = setup_logging()
@@ -102,52 +163,107 @@ def generate_buckets_diff(
 
     date_string = datetime.now().strftime("%Y-%m-%d")
 
-    # Retrieve keys from inventory bucket
-    source_keys = get_and_filter_cogs_keys()
+    # The stages run at the same time and share max_threads, ODC needs few
+    # database connections and the rest is split between the inventories
+    odc_threads = max(1, min(ODC_EXPORT_PARTITIONS, max_threads // 4))
+    inventory_threads = max(1, (max_threads - odc_threads) // 2)
+
+    s2_s3 = s3_client(
+        region_name=SENTINEL_2_REGION, max_pool_connections=inventory_threads
+    )
 
     output_filename = "No missing scenes were found"
 
     if update_stac:
         log.info("FORCED UPDATE ACTIVE!")
-        missing_scenes = set(f"s3://sentinel-cogs/{key}" for key in source_keys)
-        orphaned_keys = set()
+        # Retrieve keys from inventory bucket
+        source_keys = get_and_filter_cogs_keys(n_threads=max_threads)
+        missing_scenes = prefix_keys(source_keys, "s3://sentinel-cogs/")
+        orphaned_keys = []
+        missing_odc_scenes = []
+        orphaned_odc_scenes = []
+        indexed_keys = {}
 
     else:
-        destination_keys = set(
-            ns.Key
-            for ns in list_inventory(
-                manifest=f"{SENTINEL_2_INVENTORY_PATH}",
-                prefix=BASE_FOLDER_NAME,
-                contains=".json",
-                n_threads=200,
+        source_s3 = s3_client(
+            region_name=SOURCE_REGION, max_pool_connections=inventory_threads
+        )
+        source_manifest = find_latest_manifest(f"{SOURCE_INVENTORY_PATH}", source_s3)
+        destination_manifest = find_latest_manifest(
+            f"{SENTINEL_2_INVENTORY_PATH}", s2_s3
+        )
+        state_url = str(s2_status_report_path / GAP_STATE_FOLDER)
+        state = read_gap_state(state_url, s2_s3) if incremental else None
+
+        # The inventory scans and the ODC query are independent, so they run
+        # concurrently and are joined before the diff. The inventories are
+        # rewritten daily and always read in full, an incremental report
+        # only queries the ODC datasets indexed since the last one.
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            # Retrieve keys from inventory bucket
+            source_stage = executor.submit(
+                get_and_filter_cogs_keys,
+                manifest=source_manifest,
+                n_threads=inventory_threads,
             )
+            destination_stage = executor.submit(
+                get_destination_keys,
+                destination_manifest,
+                s2_s3,
+                n_threads=inventory_threads,
+            )
+
+            if state is None:
+                log.info("Retrieving keys from odc")
+                odc_stage = executor.submit(get_odc_keys, log, n_threads=odc_threads)
+                refreshed = datetime.now(timezone.utc)
+            else:
+                watermark = get_watermark(state.odc)
+                log.info(f"Retrieving keys from odc indexed after {watermark}")
+                odc_stage = executor.submit(
+                    get_odc_keys, log, indexed_after=watermark, n_threads=odc_threads
+                )
+                refreshed = state.refreshed
+
+            source_keys = source_stage.result()
+            destination_keys = destination_stage.result()
+            odc = odc_stage.result()
+
+        if state is not None and odc is not None:
+            odc = apply_odc_delta(state.odc, odc)
+
+        if odc is None:
+            log.error("ODC keys unavailable, ODC gaps are not reported")
+        indexed_keys = [] if odc is None else odc.column("key")
+
+        yesterday = date.today() - timedelta(days=1)
+
+        gaps = compute_gaps(
+            source_keys=source_keys,
+            destination_keys=destination_keys,
+            odc_keys=None if odc is None else indexed_keys,
+            odc_indexed_times=None if odc is None else odc.column("indexed_time"),
+            indexed_before=datetime.combine(yesterday, datetime.min.time()),
         )
-        log.info("Retrieving keys from odc")
-        all_odc_values = get_odc_keys(log)
-        indexed_keys = all_odc_values.keys()
+
+        # Without ODC keys the state is not saved, the next run starts from
+        # the previous one
+        if incremental and odc is not None:
+            write_gap_state(
+                state_url,
+                SimpleNamespace(refreshed=refreshed, odc=odc),
+                s2_s3,
+            )
 
         # Keys that are missing, they are in the source but not in the bucket
-        missing_scenes = set(
-            f"s3://sentinel-cogs/{key}"
-            for key in source_keys
-            if key not in destination_keys
-        )
+        missing_scenes = prefix_keys(gaps.missing, "s3://sentinel-cogs/")
 
         # Keys that are lost, they are in the bucket but not found in the source
-        orphaned_keys = destination_keys.difference(source_keys)
-
-        missing_odc_scenes = set(
-            key for key in destination_keys if key not in indexed_keys
-        )
+        orphaned_keys = gaps.orphan
 
-        yesterday = date.today() - timedelta(days=1)
+        missing_odc_scenes = gaps.missing_odc
 
-        orphaned_odc_scenes = set(
-            key
-            for key in indexed_keys
-            if (key not in destination_keys and yesterday > all_odc_values[key].date())
-        )
-    s2_s3 = s3_client(region_name=SENTINEL_2_REGION)
+        orphaned_odc_scenes = gaps.orphan_odc
 
     if (
         len(missing_scenes) > 0
@@ -163,20 +279,15 @@ def generate_buckets_diff(
 
         log.info(f"File will be saved in {s2_status_report_path}/{output_filename}")
 
-        missing_orphan_scenes_json = json.dumps(
-            {
-                "orphan": list(orphaned_keys),
-                "missing": list(missing_scenes),
-                "orphan_odc": list(orphaned_odc_scenes),
-                "missing_odc": list(missing_odc_scenes),
-            }
-        )
-
-        s3_dump(
-            data=missing_orphan_scenes_json,
-            url=str(URL(s2_status_report_path) / output_filename),
+        write_gap_report(
+            report_path=str(URL(s2_status_report_path) / output_filename),
+            report={
+                "orphan": orphaned_keys,
+                "missing": missing_scenes,
+                "orphan_odc": orphaned_odc_scenes,
+                "missing_odc": missing_odc_scenes,
+            },
             s3=s2_s3,
-            ContentType="application/json",
         )
     report_http_link = (
         f"https://{bucket_name}.s3.{SENTINEL_2_REGION}.amazonaws.com/status-report/{output_filename}"
@@ -226,13 +337,22 @@ def generate_buckets_diff(
     default="Bucket where the gap report is",
 )
 @update_stac
+@incremental
 @slack_url
+@click.option(
+    "--max_threads",
+    type=int,
+    default=200,
+    help="Total threads and S3 connections shared by the inventory and ODC stages",
+)
 @click.option("--version", is_flag=True, default=False)
 @click.command("s2-gap-report")
 def cli(
     bucket_name: str,
     update_stac: bool = False,
+    incremental: bool = False,
     slack_url: str = None,
+    max_threads: int = 200,
     version: bool = False,
 ):
     """
@@ -243,5 +363,9 @@ def cli(
         click.echo(__version__)
 
     generate_buckets_diff(
-        bucket_name=bucket_name, update_stac=update_stac, notification_url=slack_url
+        bucket_name=bucket_name,
+        update_stac=update_stac,
+        notification_url=slack_url,
+        incremental=incremental,
+        max_threads=max_threads,
     )
@@ -0,0 +1,274 @@
+import json
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pyarrow as pa
+from moto import mock_s3
+from odc.aws import s3_fetch
+
+from deafrica.monitoring import gap_report
+from deafrica.monitoring.gap_report import (
+    ODC_SCHEMA,
+    anti_join,
+    apply_odc_delta,
+    common_prefix,
+    compute_gaps,
+    export_odc_uris,
+    find_latest_report,
+    get_watermark,
+    odc_uris_to_keys,
+    read_gap_state,
+    read_report_worker_scenes,
+    split_time_range,
+    to_sorted_keys,
+    write_gap_report,
+    write_gap_state,
+)
+from deafrica.tests.conftest import INVENTORY_BUCKET_NAME
+from deafrica.tests.test_inventory import create_inventory_bucket
+from deafrica.utils import split_list_equally
+
+
+def odc_keys_table(odc_values: dict) -> pa.Table:
+    """
+    Convert a {key: indexed_time} dict to an ODC keys table
+    """
+    return pa.table(
+        [
+            pa.array(list(odc_values.keys()), pa.string()),
+            pa.array(list(odc_values.values()), ODC_SCHEMA.field("indexed_time").type),
+        ],
+        schema=ODC_SCHEMA,
+    )
+
+
+def test_compute_gaps():
+    gaps = compute_gaps(
+        source_keys={"a/1.json", "a/2.json", "b/1.json"},
+        destination_keys=pa.chunked_array(
+            [["a/2.json", "b/1.json"], ["c/1.json", "c/1.json"]]
+        ),
+        odc_keys=["b/1.json", "d/1.json", "e/1.json"],
+        odc_indexed_times=[
+            datetime(2024, 1, 1, tzinfo=timezone.utc),
+            datetime(2024, 1, 1, tzinfo=timezone.utc),
+            datetime(2024, 6, 1, tzinfo=timezone.utc),
+        ],
+        indexed_before=datetime(2024, 3, 1),
+    )
+    # Results stay in Arrow until the report is written
+    assert isinstance(gaps.missing, pa.Array)
+    assert gaps.missing.to_pylist() == ["a/1.json"]
+    assert gaps.orphan.to_pylist() == ["c/1.json"]
+    assert gaps.missing_odc.to_pylist() == ["a/2.json", "c/1.json"]
+    # e/1.json was indexed after the cut-off
+    assert gaps.orphan_odc.to_pylist() == ["d/1.json"]
+
+
+def test_compute_gaps_without_odc():
+    gaps = compute_gaps(source_keys=[], destination_keys=["a/1.json"])
+    assert gaps.missing.to_pylist() == []
+    assert gaps.orphan.to_pylist() == ["a/1.json"]
+    assert gaps.missing_odc.to_pylist() == []
+    assert gaps.orphan_odc.to_pylist() == []
+
+
+def test_compute_gaps_common_prefix():
+    source = ["s3://bucket/base/a/1.json", "s3://bucket/base/b/1.json"]
+    destination = ["s3://bucket/base/b/1.json", "s3://bucket/base/c/1.json"]
+    assert common_prefix(pa.array(source), pa.array(destination)) == (
+        "s3://bucket/base/"
+    )
+    assert common_prefix(pa.array([], pa.string())) == ""
+
+    gaps = compute_gaps(
+        source_keys=source, destination_keys=destination, odc_keys=source
+    )
+    assert gaps.missing.to_pylist() == ["s3://bucket/base/a/1.json"]
+    assert gaps.orphan.to_pylist() == ["s3://bucket/base/c/1.json"]
+    assert gaps.missing_odc.to_pylist() == ["s3://bucket/base/c/1.json"]
+    assert gaps.orphan_odc.to_pylist() == ["s3://bucket/base/a/1.json"]
+
+    # A key equal to the prefix is kept
+    gaps = compute_gaps(source_keys=["a/", "a/1"], destination_keys=["a/1"])
+    assert gaps.missing.to_pylist() == ["a/"]
+
+
+def test_to_sorted_keys_stays_in_arrow():
+    keys = pa.array(
+        [f"base/{i % 50_000:05}/stac.json" for i in range(100_000)]
+        + ["base/" + "x" * 200]
+    )
+    destination = to_sorted_keys(keys[:-1], "base/")
+
+    tracemalloc.start()
+    source = to_sorted_keys(keys, "base/")
+    missing = anti_join(source, destination)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # No Python object is built per key
+    assert peak < 1_000_000
+    assert source.type == pa.large_string()
+    assert source.to_pylist() == sorted(set(k[5:] for k in keys.to_pylist()))
+    assert missing.to_pylist() == ["x" * 200]
+    # Keys take their own length, not the width of the longest key
+    data_size = sum(len(key) for key in source.to_pylist())
+    assert source.buffers()[2].size < 2 * data_size
+    assert source.nbytes < len(source) * 200
+
+
+def test_apply_odc_delta():
+    odc = odc_keys_table(
+        {
+            "a/1.json": datetime(2024, 1, 1, tzinfo=timezone.utc),
+            "b/1.json": datetime(2024, 1, 2, tzinfo=timezone.utc),
+        }
+    )
+    updated = odc_keys_table(
+        {
+            "b/1.json": datetime(2024, 2, 1, tzinfo=timezone.utc),
+            "c/1.json": datetime(2024, 2, 2, tzinfo=timezone.utc),
+        }
+    )
+    odc = apply_odc_delta(odc, updated)
+    assert sorted(odc.column("key").to_pylist()) == ["a/1.json", "b/1.json", "c/1.json"]
+    assert get_watermark(odc) == datetime(2024, 2, 2, tzinfo=timezone.utc)
+
+
+def test_split_time_range():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    end = datetime(2024, 1, 5, tzinfo=timezone.utc)
+    ranges = split_time_range(start, end, 4)
+    assert len(ranges) == 4
+    assert ranges[0][0] == start
+    assert ranges[-1][1] > end
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+    # A single dataset still gets a range containing it
+    assert split_time_range(start, start, 4) == [
+        (start, start + timedelta(microseconds=1))
+    ]
+
+
+def test_odc_uris_to_keys():
+    indexed_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    uris = pa.table(
+        {
+            "uri": ["s3://deafrica-sentinel-2/a/1.json"],
+            "indexed_time": pa.array([indexed_time], pa.timestamp("us", tz="UTC")),
+        }
+    )
+    odc = odc_uris_to_keys(uris, "s3://deafrica-sentinel-2/")
+    assert odc.equals(odc_keys_table({"a/1.json": indexed_time}))
+
+    # Only a leading bucket url is removed
+    uris = pa.table(
+        {
+            "uri": [
+                "s3://deafrica-sentinel-2/a/s3://deafrica-sentinel-2/1.json",
+                "s3://other-bucket/s3://deafrica-sentinel-2/1.json",
+            ],
+            "indexed_time": pa.array([indexed_time] * 2, pa.timestamp("us", tz="UTC")),
+        }
+    )
+    odc = odc_uris_to_keys(uris, "s3://deafrica-sentinel-2/")
+    assert odc.column("key").to_pylist() == [
+        "a/s3://deafrica-sentinel-2/1.json",
+        "s3://other-bucket/s3://deafrica-sentinel-2/1.json",
+    ]
+
+
+def test_export_odc_uris_search_fallback():
+    indexed_times = [
+        datetime(2024, 1, 1, tzinfo=timezone.utc),
+        datetime(2024, 6, 1, tzinfo=timezone.utc),
+    ]
+    datasets = SimpleNamespace(
+        search_returning=lambda fields, product: [
+            SimpleNamespace(uri=f"s3://bucket/{product}/{i}.json", indexed_time=time)
+            for i, time in enumerate(indexed_times)
+        ]
+    )
+    # Other index drivers have no postgres tables and use the search API
+    dc = SimpleNamespace(index=SimpleNamespace(name="pgis_index", datasets=datasets))
+
+    uris = export_odc_uris(dc, ["s2_l2a"])
+    assert uris.column("uri").to_pylist() == [
+        "s3://bucket/s2_l2a/0.json",
+        "s3://bucket/s2_l2a/1.json",
+    ]
+    uris = export_odc_uris(dc, ["s2_l2a"], indexed_after=datetime(2024, 3, 1))
+    assert uris.column("uri").to_pylist() == ["s3://bucket/s2_l2a/1.json"]
+
+
+@mock_s3
+def test_gap_state():
+    s3_client = create_inventory_bucket()
+    state_url = f"s3://{INVENTORY_BUCKET_NAME}/status-report/state"
+    assert read_gap_state(state_url, s3_client) is None
+
+    state = SimpleNamespace(
+        refreshed=datetime.now(timezone.utc),
+        odc=odc_keys_table({"a/1.json": datetime(2024, 1, 1, tzinfo=timezone.utc)}),
+    )
+    write_gap_state(state_url, state, s3_client)
+
+    saved = read_gap_state(state_url, s3_client)
+    assert saved.refreshed == state.refreshed
+    assert saved.odc.equals(state.odc)
+
+    # Old states are rebuilt from scratch
+    state.refreshed -= timedelta(days=30)
+    write_gap_state(state_url, state, s3_client)
+    assert read_gap_state(state_url, s3_client) is None
+
+
+@mock_s3
+def test_gap_report_shards():
+    s3_client = create_inventory_bucket()
+    report_folder = f"s3://{INVENTORY_BUCKET_NAME}/status-report"
+    report_path = f"{report_folder}/2024-01-01_gap_report.json"
+    missing = [f"scene/{i:03d}.json" for i in reversed(range(25))]
+
+    with patch.object(gap_report, "GAP_REPORT_SHARD_SIZE", 4):
+        write_gap_report(
+            report_path, {"missing": pa.array(missing), "orphan": []}, s3_client
+        )
+    report = json.loads(s3_fetch(report_path, s3=s3_client))
+    assert report == {"missing": missing, "orphan": []}
+
+    # The shards are not taken for a report
+    assert find_latest_report(report_folder) == report_path
+
+    for limit in [None, 10]:
+        expected = split_list_equally(sorted(missing)[:limit], 3)
+        for idx in range(3):
+            scenes, total = read_report_worker_scenes(
+                report_path, "missing", idx=idx, max_workers=3, limit=limit
+            )
+            assert scenes == expected[idx]
+            assert total == len(sorted(missing)[:limit])
+
+    assert read_report_worker_scenes(report_path, "orphan", 0, 3) == ([], 0)
+    assert read_report_worker_scenes(report_path, "missing", 30, 30) == ([], 25)
+
+
+@mock_s3
+def test_gap_report_without_shards():
+    s3_client = create_inventory_bucket()
+    report_path = (
+        f"s3://{INVENTORY_BUCKET_NAME}/status-report/2024-01-01_gap_report.json"
+    )
+    s3_client.put_object(
+        Bucket=INVENTORY_BUCKET_NAME,
+        Key="status-report/2024-01-01_gap_report.json",
+        Body=json.dumps({"missing": ["b", "a", "c"], "missing_odc": ["d", "e"]}),
+    )
+    assert read_report_worker_scenes(report_path, "missing", 1, 2) == (["c"], 3)
+    assert read_report_worker_scenes(report_path, "missing_odc", 0, 2, limit=1) == (
+        ["d"],
+        1,
+    )
@@ -0,0 +1,412 @@
+import csv
+import gzip
+import hashlib
+import json
+import socket
+from io import BytesIO
+
+import boto3
+import pyarrow as pa
+import pyarrow.orc as orc
+import pyarrow.parquet as pq
+import pytest
+import requests
+from moto import mock_s3
+from moto.server import ThreadedMotoServer
+
+from deafrica import inventory
+from deafrica.inventory import (
+    compile_key_filter,
+    iter_parquet_row_groups,
+    list_inventory,
+    list_inventory_batches,
+    resolve_columns,
+    retrieve_manifest_batches,
+)
+from deafrica.tests.conftest import (
+    INVENTORY_BUCKET_NAME,
+    INVENTORY_DATA_FILE,
+    INVENTORY_FOLDER,
+    INVENTORY_MANIFEST_FILE,
+    REGION,
+    TEST_DATA_DIR,
+)
+
+PARQUET_KEYS = [f"sentinel-2-c1-l2a/{i:04d}/scene_{i:04d}.json" for i in range(50)]
+
+
+def create_inventory_bucket():
+    s3_client = boto3.client("s3", region_name=REGION)
+    s3_client.create_bucket(
+        Bucket=INVENTORY_BUCKET_NAME,
+        CreateBucketConfiguration={
+            "LocationConstraint": REGION,
+        },
+    )
+    return s3_client
+
+
+def upload_parquet_manifest(
+    s3_client,
+    data_files: dict[str, list[str]],
+    date: str = "2021-09-17T00-00Z",
+    row_group_size: int = 10,
+) -> str:
+    files = []
+    for name, keys in data_files.items():
+        table = pa.table(
+            {
+                "bucket": ["e84-earth-search-sentinel-data"] * len(keys),
+                "key": keys,
+                "size": list(range(len(keys))),
+            }
+        )
+        buffer = BytesIO()
+        pq.write_table(table, buffer, row_group_size=row_group_size)
+        data_key = f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/data/{name}"
+        s3_client.put_object(
+            Bucket=INVENTORY_BUCKET_NAME, Key=data_key, Body=buffer.getvalue()
+        )
+        files.append(
+            {
+                "key": data_key,
+                "size": len(buffer.getvalue()),
+                "MD5checksum": hashlib.md5(buffer.getvalue()).hexdigest(),
+            }
+        )
+
+    manifest = {
+        "sourceBucket": "e84-earth-search-sentinel-data",
+        "destinationBucket": f"arn:aws:s3:::{INVENTORY_BUCKET_NAME}",
+        "fileFormat": "Parquet",
+        "fileSchema": "message s3.inventory { required binary bucket; }",
+        "files": files,
+    }
+    manifest_key = (
+        f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/{date}/{INVENTORY_MANIFEST_FILE}"
+    )
+    s3_client.put_object(
+        Bucket=INVENTORY_BUCKET_NAME, Key=manifest_key, Body=json.dumps(manifest)
+    )
+    return f"s3://{INVENTORY_BUCKET_NAME}/{manifest_key}"
+
+
+def upload_parquet_inventory(s3_client, row_group_size: int = 10) -> str:
+    return upload_parquet_manifest(
+        s3_client,
+        {"data_file.parquet": PARQUET_KEYS},
+        row_group_size=row_group_size,
+    )
+
+
+def test_resolve_columns():
+    names = ["bucket", "key", "size"]
+    assert resolve_columns(names, None) == names
+    assert resolve_columns(names, ["Key"]) == ["key"]
+    assert resolve_columns(names, ["Size"]) == ["key", "size"]
+    assert resolve_columns([*names, "last_modified_date"], ["LastModifiedDate"]) == [
+        "key",
+        "last_modified_date",
+    ]
+    with pytest.raises(ValueError):
+        resolve_columns(names, ["etag"])
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {},
+        {"prefix": "collection02"},
+        {"suffix": "_stac.json"},
+        {"contains": "LC08"},
+        {"prefix": "collection02", "suffix": ".json", "contains": "stac"},
+        {"suffix": "_stac.json", "multiple_contains": ("LC08", "LC09")},
+        {"multiple_contains": ()},
+    ],
+)
+def test_compile_key_filter(filters):
+    keys = [
+        "collection02/level-2/LC08_L2SP_176051/LC08_L2SP_176051_stac.json",
+        "collection02/level-2/LC09_L2SP_176051/LC09_L2SP_176051_ST_B10.TIF",
+        "collection02/level-2/LE07_L2SP_176051/LE07_L2SP_176051_stac.json",
+        "sentinel-s2-l2a-cogs/35/P/KS/S2A_35PKS_20180919_0_L2A.json",
+    ]
+    mask = compile_key_filter(**filters)(pa.array(keys)).to_pylist()
+    assert mask == [inventory.test_key(key, **filters) for key in keys]
+
+
+@mock_s3
+def test_iter_parquet_row_groups():
+    s3_client = create_inventory_bucket()
+    upload_parquet_inventory(s3_client, row_group_size=10)
+    data_url = (
+        f"s3://{INVENTORY_BUCKET_NAME}/{INVENTORY_FOLDER}/"
+        f"{INVENTORY_BUCKET_NAME}/data/data_file.parquet"
+    )
+
+    tables = list(iter_parquet_row_groups(data_url, s3_client, columns=["key"]))
+    assert len(tables) == 5
+    assert all(table.column_names == ["key"] for table in tables)
+    keys = [key for table in tables for key in table.column("key").to_pylist()]
+    assert keys == PARQUET_KEYS
+
+    # Only the row group holding 0010 to 0019 can match the prefix
+    tables = list(
+        iter_parquet_row_groups(data_url, s3_client, prefix="sentinel-2-c1-l2a/001")
+    )
+    assert len(tables) == 1
+    assert tables[0].column("key").to_pylist() == PARQUET_KEYS[10:20]
+    assert len(list(iter_parquet_row_groups(data_url, s3_client, prefix="zzz"))) == 0
+
+
+@mock_s3
+def test_list_inventory_parquet_columns():
+    s3_client = create_inventory_bucket()
+    manifest = upload_parquet_inventory(s3_client)
+
+    records = list(
+        list_inventory(manifest, s3=s3_client, suffix="7.json", columns=["key"])
+    )
+    assert [r.key for r in records] == [k for k in PARQUET_KEYS if k.endswith("7.json")]
+    assert not hasattr(records[0], "bucket")
+
+    records = list(
+        list_inventory(manifest, s3=s3_client, prefix="sentinel-2-c1-l2a/002")
+    )
+    assert [r.key for r in records] == PARQUET_KEYS[20:30]
+
+
+@mock_s3
+def test_list_inventory_threads():
+    s3_client = create_inventory_bucket()
+    manifest = upload_parquet_inventory(s3_client)
+
+    records = list(list_inventory(manifest, s3=s3_client, n_threads=4, max_in_flight=2))
+    assert sorted(r.key for r in records) == PARQUET_KEYS
+
+
+@mock_s3
+def test_list_inventory_cache(tmp_path):
+    s3_client = create_inventory_bucket()
+    manifest = upload_parquet_inventory(s3_client)
+
+    records = list(
+        list_inventory(manifest, s3=s3_client, suffix="7.json", cache_dir=tmp_path)
+    )
+    empty = list(
+        list_inventory(manifest, s3=s3_client, suffix=".tif", cache_dir=tmp_path)
+    )
+    assert len(records) == 5
+    assert empty == []
+    assert len(list(tmp_path.glob("*.arrow"))) == 2
+
+    # Cached data files are read without going back to S3
+    s3_client.delete_object(
+        Bucket=INVENTORY_BUCKET_NAME,
+        Key=f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/data/data_file.parquet",
+    )
+    assert (
+        list(
+            list_inventory(manifest, s3=s3_client, suffix="7.json", cache_dir=tmp_path)
+        )
+        == records
+    )
+    assert (
+        list(list_inventory(manifest, s3=s3_client, suffix=".tif", cache_dir=tmp_path))
+        == []
+    )
+
+
+@mock_s3
+def test_list_inventory_orc():
+    s3_client = create_inventory_bucket()
+    table = pa.table(
+        {
+            "bucket": ["e84-earth-search-sentinel-data"] * len(PARQUET_KEYS),
+            "key": PARQUET_KEYS,
+            "size": list(range(len(PARQUET_KEYS))),
+        }
+    )
+    buffer = BytesIO()
+    orc.write_table(table, buffer)
+    data_key = f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/data/data_file.orc"
+    s3_client.put_object(
+        Bucket=INVENTORY_BUCKET_NAME, Key=data_key, Body=buffer.getvalue()
+    )
+    manifest = {
+        "sourceBucket": "e84-earth-search-sentinel-data",
+        "destinationBucket": f"arn:aws:s3:::{INVENTORY_BUCKET_NAME}",
+        "fileFormat": "ORC",
+        "fileSchema": "struct<bucket:string,key:string,size:bigint>",
+        "files": [{"key": data_key}],
+    }
+    manifest_key = (
+        f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/"
+        f"2021-09-17T00-00Z/{INVENTORY_MANIFEST_FILE}"
+    )
+    s3_client.put_object(
+        Bucket=INVENTORY_BUCKET_NAME, Key=manifest_key, Body=json.dumps(manifest)
+    )
+
+    records = list(
+        list_inventory(
+            f"s3://{INVENTORY_BUCKET_NAME}/{manifest_key}",
+            s3=s3_client,
+            suffix="7.json",
+            columns=["key"],
+        )
+    )
+    assert [r.key for r in records] == [k for k in PARQUET_KEYS if k.endswith("7.json")]
+    assert not hasattr(records[0], "size")
+
+
+@mock_s3
+def test_list_inventory_csv_columns():
+    s3_client = create_inventory_bucket()
+    s3_client.upload_file(
+        str(TEST_DATA_DIR / "sentinel_2" / INVENTORY_MANIFEST_FILE),
+        INVENTORY_BUCKET_NAME,
+        f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/2021-09-17T00-00Z/{INVENTORY_MANIFEST_FILE}",
+    )
+    s3_client.upload_file(
+        str(TEST_DATA_DIR / "sentinel_2" / INVENTORY_DATA_FILE),
+        INVENTORY_BUCKET_NAME,
+        f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/data/{INVENTORY_DATA_FILE}",
+    )
+
+    records = list(
+        list_inventory(
+            f"s3://{INVENTORY_BUCKET_NAME}/{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/",
+            s3=s3_client,
+            contains=".json",
+            columns=["Key"],
+        )
+    )
+    assert len(records) == 6
+    assert all(vars(r).keys() == {"Key"} for r in records)
+
+
+@pytest.fixture
+def moto_server(monkeypatch):
+    """
+    S3 served over HTTP. Unlike mock_s3, it's reachable from worker
+    processes that don't inherit the patching of the test process.
+    """
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    url = f"http://127.0.0.1:{port}"
+    # The backends are shared by every server of the test process
+    requests.post(f"{url}/moto-api/reset")
+    yield url
+    server.stop()
+
+
+@pytest.mark.parametrize("start_method", ["spawn", "forkserver"])
+def test_list_inventory_decode_processes(moto_server, monkeypatch, start_method):
+    monkeypatch.setattr(inventory, "DECODE_START_METHOD", start_method)
+    s3_client = boto3.client("s3", region_name=REGION, endpoint_url=moto_server)
+    s3_client.create_bucket(
+        Bucket=INVENTORY_BUCKET_NAME,
+        CreateBucketConfiguration={"LocationConstraint": REGION},
+    )
+    s3_client.upload_file(
+        str(TEST_DATA_DIR / "sentinel_2" / INVENTORY_MANIFEST_FILE),
+        INVENTORY_BUCKET_NAME,
+        f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/2021-09-17T00-00Z/{INVENTORY_MANIFEST_FILE}",
+    )
+    s3_client.upload_file(
+        str(TEST_DATA_DIR / "sentinel_2" / INVENTORY_DATA_FILE),
+        INVENTORY_BUCKET_NAME,
+        f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/data/{INVENTORY_DATA_FILE}",
+    )
+
+    kwargs = {
+        "manifest": f"s3://{INVENTORY_BUCKET_NAME}/{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/",
+        "s3": s3_client,
+        "contains": ".json",
+        "columns": ["Key"],
+    }
+    records = list(list_inventory(**kwargs))
+    process_records = list(list_inventory(decode_processes=2, **kwargs))
+    assert len(records) == 6
+    assert process_records == records
+
+
+@mock_s3
+def test_list_inventory_batches():
+    s3_client = create_inventory_bucket()
+    manifest = upload_parquet_inventory(s3_client)
+
+    batches = list(
+        list_inventory_batches(manifest, s3=s3_client, suffix="7.json", n_threads=2)
+    )
+    table = pa.Table.from_batches(batches)
+    assert table.schema == pa.schema(
+        [("Bucket", pa.string()), ("Key", pa.string()), ("Size", pa.int64())]
+    )
+    assert table.column("Key").to_pylist() == [
+        k for k in PARQUET_KEYS if k.endswith("7.json")
+    ]
+
+
+@mock_s3
+def test_list_inventory_batches_csv():
+    s3_client = create_inventory_bucket()
+    s3_client.upload_file(
+        str(TEST_DATA_DIR / "sentinel_2" / INVENTORY_MANIFEST_FILE),
+        INVENTORY_BUCKET_NAME,
+        f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/2021-09-17T00-00Z/{INVENTORY_MANIFEST_FILE}",
+    )
+    s3_client.upload_file(
+        str(TEST_DATA_DIR / "sentinel_2" / INVENTORY_DATA_FILE),
+        INVENTORY_BUCKET_NAME,
+        f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/data/{INVENTORY_DATA_FILE}",
+    )
+
+    batches = list(
+        list_inventory_batches(
+            f"s3://{INVENTORY_BUCKET_NAME}/{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/",
+            s3=s3_client,
+            contains=".json",
+            columns=["Size", "LastModifiedDate"],
+        )
+    )
+    table = pa.Table.from_batches(batches)
+    assert table.schema == pa.schema(
+        [
+            ("Key", pa.string()),
+            ("Size", pa.int64()),
+            ("LastModifiedDate", pa.timestamp("ms", tz="UTC")),
+        ]
+    )
+    assert table.num_rows == 6
+
+
+@mock_s3
+def test_retrieve_manifest_batches_csv_streaming(monkeypatch):
+    monkeypatch.setattr(inventory, "CSV_BATCH_SIZE", 4)
+    s3_client = create_inventory_bucket()
+    s3_client.upload_file(
+        str(TEST_DATA_DIR / "sentinel_2" / INVENTORY_DATA_FILE),
+        INVENTORY_BUCKET_NAME,
+        INVENTORY_DATA_FILE,
+    )
+
+    tables = list(
+        retrieve_manifest_batches(
+            f"s3://{INVENTORY_BUCKET_NAME}/{INVENTORY_DATA_FILE}",
+            s3_client,
+            ("Bucket", "Key", "Size", "LastModifiedDate"),
+            "CSV",
+            columns=["Key"],
+        )
+    )
+    assert all(table.num_rows <= 4 for table in tables)
+    keys = [key for table in tables for key in table.column("Key").to_pylist()]
+    with gzip.open(TEST_DATA_DIR / "sentinel_2" / INVENTORY_DATA_FILE, "rt") as f:
+        assert keys == [row[1] for row in csv.reader(f)]
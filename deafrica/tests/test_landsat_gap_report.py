@@ -1,12 +1,18 @@
-from unittest.mock import PropertyMock, patch
+from unittest.mock import patch
 
 import boto3
+import pandas as pd
+import pyarrow as pa
+import pytest
 from click.testing import CliRunner
 from moto import mock_s3
 from yarl import URL
 
+from deafrica.monitoring import landsat_gap_report
 from deafrica.monitoring.landsat_gap_report import (
     cli,
+    filter_bulk_rows,
+    filter_satellite_keys,
     get_and_filter_keys,
     get_and_filter_keys_from_files,
 )
@@ -32,6 +38,79 @@ def test_get_and_filter_keys_from_files():
     assert len(keys) == 20
 
 
+def test_filter_bulk_rows():
+    rows = pd.DataFrame(
+        {
+            "Satellite": ["8", "4", "8", "8", None],
+            "Day/Night Indicator": ["DAY", "DAY", "NIGHT", "day", "DAY"],
+            "WRS Path": ["188", "188", "188", "1", "188"],
+            "WRS Row": ["36", "36", "36", "2", "36"],
+            "Date Acquired": [
+                "2020/09/11",
+                "1990-01-01",
+                "2020/09/11",
+                "2021-01-01",
+                "",
+            ],
+            "Sensor Identifier": ["OLI_TIRS"] * 5,
+            "Display ID": ["A", "B", "C", "D", "E"],
+        }
+    )
+    paths = filter_bulk_rows(rows, {188036, 1002})
+    assert paths.tolist() == [
+        "collection02/level-2/standard/oli-tirs/2020/188/036/A/",
+        "collection02/level-2/standard/oli-tirs/2021/001/002/D/",
+    ]
+
+    # Rows with a blank field are skipped
+    rows.loc[0, "Display ID"] = None
+    rows.loc[3, "Date Acquired"] = None
+    assert filter_bulk_rows(rows, {188036, 1002}).tolist() == []
+
+
+def test_get_and_filter_keys_from_files_blank_display_id(tmp_path):
+    bulk_file = tmp_path / "bulk.csv.gz"
+    pd.DataFrame(
+        {
+            "Satellite": ["8", "8"],
+            "Day/Night Indicator": ["DAY", "DAY"],
+            "WRS Path": ["188", "188"],
+            "WRS Row": ["36", "37"],
+            "Date Acquired": ["2020/09/11", "2020/09/11"],
+            "Sensor Identifier": ["OLI_TIRS", "OLI_TIRS"],
+            "Display ID": ["A", ""],
+        }
+    ).to_csv(bulk_file, index=False, compression="gzip")
+
+    with patch.object(
+        landsat_gap_report, "get_africa_pathrows", return_value={188036, 188037}
+    ):
+        assert get_and_filter_keys_from_files(bulk_file) == {
+            "collection02/level-2/standard/oli-tirs/2020/188/036/A/"
+        }
+
+        # A bulk file without a column can't be read
+        pd.DataFrame({"Satellite": ["8"]}).to_csv(
+            bulk_file, index=False, compression="gzip"
+        )
+        with pytest.raises(ValueError, match="Display ID"):
+            get_and_filter_keys_from_files(bulk_file)
+
+
+def test_filter_satellite_keys():
+    keys = pa.array(
+        [
+            "collection02/level-2/standard/oli-tirs/2021/188/036/LC08_L2SP_188036_20210101_20210308_02_T1/",
+            "collection02/level-2/standard/oli-tirs/2022/188/036/LC09_L2SP_188036_20220101_20220308_02_T1/",
+            "collection02/level-2/standard/etm/2021/188/036/LE07_L2SP_188036_20210101_20210308_02_T1/",
+            "collection02/level-2/standard/tm/2000/188/036/LT05_L2SP_188036_20000101_20200908_02_T1/",
+        ]
+    )
+    assert len(filter_satellite_keys(keys, ["ls8", "ls9"])) == 2
+    assert filter_satellite_keys(keys, ["ls7"]).to_pylist() == [keys[2].as_py()]
+    assert filter_satellite_keys(keys, ["ls5"]).to_pylist() == [keys[3].as_py()]
+
+
 @mock_s3
 def test_get_and_filter_keys(
     s3_inventory_data_file: URL,
@@ -117,9 +196,8 @@ def test_landsat_gap_report_cli(
         "deafrica.monitoring.landsat_gap_report.LANDSAT_INVENTORY_PATH",
         s3_inventory_path,
     ), patch(
-        "deafrica.monitoring.landsat_gap_report.download_file_to_tmp",
-        new_callable=PropertyMock,
-        return_value=FAKE_LANDSAT_BULK_FILE,
+        "deafrica.monitoring.landsat_gap_report.open_file_download",
+        side_effect=lambda **kwargs: FAKE_LANDSAT_BULK_FILE.open("rb"),
     ):
         runner = CliRunner()
         runner.invoke(
@@ -130,6 +208,11 @@ def test_landsat_gap_report_cli(
             ],
         )
 
-        bucket_objs = list(boto3.resource("s3").Bucket(TEST_BUCKET_NAME).objects.all())
+        # The report and its sharded copy
+        bucket_objs = [
+            obj
+            for obj in boto3.resource("s3").Bucket(TEST_BUCKET_NAME).objects.all()
+            if "/shards/" not in obj.key
+        ]
         assert len(bucket_objs) == 1
         assert "Landsat_5" in bucket_objs[0].key
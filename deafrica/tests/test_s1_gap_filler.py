@@ -0,0 +1,69 @@
+from unittest.mock import MagicMock, patch
+
+import boto3
+from click.testing import CliRunner
+from moto import mock_sns
+
+from deafrica.monitoring import s1_gap_filler
+from deafrica.monitoring.s1_gap_filler import cli, publish_scenes_batch
+from deafrica.tests.conftest import REGION
+
+
+@mock_sns
+def test_publish_scenes_batch():
+    sns_client = boto3.client("sns", region_name=REGION)
+    topic_arn = sns_client.create_topic(Name="test-topic")["TopicArn"]
+
+    scenes = [f"s1_rtc/grid/2020/01/0{i}/ABC12{i}/metadata.json" for i in range(5)]
+    failed = publish_scenes_batch(
+        scenes,
+        sns_client=sns_client,
+        sns_topic_arn=topic_arn,
+        bucket_name="test-bucket",
+    )
+    assert failed == []
+
+
+def test_publish_scenes_batch_retries_failed_entries(monkeypatch):
+    monkeypatch.setattr(s1_gap_filler, "SNS_RETRY_DELAY", 0)
+    sns_client = MagicMock()
+    sns_client.publish_batch.side_effect = [
+        {
+            "Successful": [{"Id": "0", "MessageId": "a"}],
+            "Failed": [
+                {"Id": "1", "SenderFault": False, "Message": "Throttled"},
+                {"Id": "2", "SenderFault": True, "Message": "Invalid"},
+            ],
+        },
+        {"Successful": [{"Id": "1", "MessageId": "b"}], "Failed": []},
+    ]
+
+    failed = publish_scenes_batch(
+        ["a", "b", "c"],
+        sns_client=sns_client,
+        sns_topic_arn="arn",
+        bucket_name="test-bucket",
+    )
+    assert failed == ["c"]
+    # Only the entry that failed on the SNS side is sent again
+    retried = sns_client.publish_batch.call_args_list[1].kwargs
+    assert [entry["Id"] for entry in retried["PublishBatchRequestEntries"]] == ["1"]
+
+
+def test_s1_gap_filler_dryrun_publishes_nothing():
+    with patch.object(
+        s1_gap_filler, "find_latest_report", return_value="s3://bucket/report.json"
+    ), patch.object(
+        s1_gap_filler,
+        "read_report_worker_scenes",
+        return_value=(["s1_rtc/a/metadata.json"], 1),
+    ), patch.object(
+        s1_gap_filler, "publish_scenes_batch"
+    ) as publish, patch.object(
+        s1_gap_filler.boto3, "client"
+    ) as client:
+        result = CliRunner().invoke(cli, ["0", "1", "arn", "--dryrun"])
+
+    assert result.exit_code == 0
+    publish.assert_not_called()
+    client.assert_not_called()
@@ -1,11 +1,15 @@
+from datetime import datetime, timezone
 from unittest.mock import patch
 
 import boto3
+import pyarrow as pa
 from moto import mock_s3
 from yarl import URL
 
 from deafrica.monitoring import s2_gap_report
+from deafrica.monitoring.gap_report import ODC_SCHEMA
 from deafrica.monitoring.s2_gap_report import (
+    filter_cogs_keys,
     generate_buckets_diff,
     get_and_filter_cogs_keys,
 )
@@ -20,12 +24,28 @@ from deafrica.tests.conftest import (
     REPORT_FOLDER,
     TEST_DATA_DIR,
 )
+from deafrica.tests.test_gap_report import odc_keys_table
 
 DATA_FOLDER = "sentinel_2"
 INVENTORY_MANIFEST_FILE = TEST_DATA_DIR / DATA_FOLDER / INVENTORY_MANIFEST_FILE
 INVENTORY_DATA_FILE = TEST_DATA_DIR / DATA_FOLDER / INVENTORY_DATA_FILE
 
 
+def test_filter_cogs_keys():
+    folder = "sentinel-s2-l2a-cogs/35/P/KS/2023/6"
+    keys = pa.array(
+        [
+            f"{folder}/S2A_35PKS_20230603_0_L2A/S2A_35PKS_20230603_0_L2A.json",
+            f"{folder}/S2A_35PKS_20230603_0_L2A/tileinfo_metadata.json",
+            "sentinel-s2-l2a-cogs/2023/S2A_35PKS_20230603_0_L2A/stac.json",
+            "sentinel-s2-l2a-cogs/31/U/DQ/S2A_31UDQ_20230603_0_L2A/stac.json",
+            "sentinel-s2-l2a-cogs/no_tile.json",
+        ]
+    )
+    filtered = filter_cogs_keys(keys, pa.array(["35PKS"]))
+    assert filtered.to_pylist() == [keys[0].as_py()]
+
+
 @mock_s3
 def test_get_and_filter_cogs_keys(
     s3_inventory_data_file: URL,
@@ -144,3 +164,62 @@ def test_generate_buckets_diff(
             )
             == 0
         )
+
+
+@mock_s3
+def test_generate_buckets_diff_incremental(s3_inventory_manifest_file: URL):
+    s3_clients = {}
+    for bucket, region in [
+        (INVENTORY_BUCKET_SOURCE_NAME, COGS_REGION),
+        (INVENTORY_BUCKET_NAME, REGION),
+    ]:
+        s3_client = boto3.client("s3", region_name=region)
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": region},
+        )
+        s3_client.upload_file(
+            str(INVENTORY_MANIFEST_FILE), bucket, str(s3_inventory_manifest_file)
+        )
+        s3_clients[bucket] = s3_client
+
+    data_key = f"{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/data/data_file.csv.gz"
+    s3_client = s3_clients[INVENTORY_BUCKET_NAME]
+    s3_client.upload_file(str(INVENTORY_DATA_FILE), INVENTORY_BUCKET_NAME, data_key)
+
+    s3_inventory_path = URL(
+        f"s3://{INVENTORY_BUCKET_NAME}/{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/"
+    )
+    s3_cogs_inventory_path = URL(
+        f"s3://{INVENTORY_BUCKET_SOURCE_NAME}/{INVENTORY_FOLDER}/{INVENTORY_BUCKET_NAME}/"
+    )
+
+    indexed_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    odc = odc_keys_table({"other/1.json": indexed_time})
+
+    with patch.object(
+        s2_gap_report, "SOURCE_INVENTORY_PATH", str(s3_cogs_inventory_path)
+    ), patch.object(
+        s2_gap_report, "SENTINEL_2_INVENTORY_PATH", str(s3_inventory_path)
+    ), patch.object(
+        s2_gap_report, "BASE_FOLDER_NAME", str(INVENTORY_FOLDER)
+    ), patch.object(
+        s2_gap_report, "get_africa_tile_ids", return_value={"35PKS"}
+    ), patch.object(
+        s2_gap_report, "get_odc_keys", return_value=odc
+    ) as get_odc_keys:
+        generate_buckets_diff(bucket_name=INVENTORY_BUCKET_NAME, incremental=True)
+        state_objects = s3_client.list_objects_v2(
+            Bucket=INVENTORY_BUCKET_NAME, Prefix=f"{REPORT_FOLDER}/state/"
+        ).get("Contents", [])
+        # Only the ODC keys are saved, the inventories are always read
+        assert sorted(obj["Key"].rsplit("/", 1)[-1] for obj in state_objects) == [
+            "odc.parquet",
+            "state.json",
+        ]
+        assert get_odc_keys.call_args.kwargs.get("indexed_after") is None
+
+        # The next report only queries datasets indexed since the last one
+        get_odc_keys.return_value = ODC_SCHEMA.empty_table()
+        generate_buckets_diff(bucket_name=INVENTORY_BUCKET_NAME, incremental=True)
+        assert get_odc_keys.call_args.kwargs["indexed_after"] == indexed_time
@@ -1,7 +1,13 @@
+import json
+import threading
+import time
+from pathlib import Path
+
 import boto3
 import pytest
 from moto import mock_s3, mock_sqs
 from odc.aws.queue import publish_message
+from werkzeug import Response
 from yarl import URL
 
 from deafrica.monitoring.check_dead_queues import check_deadletter_queues
@@ -11,6 +17,11 @@ from deafrica.monitoring.gap_report import (
 )
 from deafrica.tests.conftest import REGION, TEST_BUCKET_NAME, TEST_DATA_DIR
 from deafrica.utils import (
+    download_file_to_tmp,
+    get_derived_reference,
+    get_reference_file,
+    map_bounded,
+    open_file_download,
     split_list_equally,
 )
 
@@ -145,3 +156,150 @@ def test_split_list():
     assert len(perfect_division) == max_of_workers
     assert len(smaller_division) < max_of_workers
     assert len(bigger_division) == max_of_workers
+
+
+def test_map_bounded():
+    in_flight = []
+    max_seen = []
+    lock = threading.Lock()
+
+    def work(item):
+        with lock:
+            in_flight.append(item)
+            max_seen.append(len(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.remove(item)
+        return item * 2
+
+    results = list(map_bounded(work, range(20), n_threads=4, max_in_flight=3))
+
+    assert sorted(results) == [i * 2 for i in range(20)]
+    assert max(max_seen) <= 3
+
+
+def test_download_file_to_tmp(httpserver):
+    file_name = "deafrica-test-download.txt"
+    url = httpserver.url_for("/")
+    requests_headers = []
+
+    def answer(request):
+        requests_headers.append(request.headers)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return Response(status=304)
+        return Response(b"line\n" * 1000, headers={"ETag": '"v1"'})
+
+    httpserver.expect_request(f"/{file_name}").respond_with_handler(answer)
+
+    try:
+        file_path = download_file_to_tmp(url, file_name)
+        assert file_path.read_bytes() == b"line\n" * 1000
+        assert "If-None-Match" not in requests_headers[0]
+
+        # Unchanged on the server, so it is not transferred again
+        assert download_file_to_tmp(url, file_name) == file_path
+        assert download_file_to_tmp(url, file_name, always_return_path=False) is None
+        assert requests_headers[-1]["If-None-Match"] == '"v1"'
+    finally:
+        for path in [f"/tmp/{file_name}", f"/tmp/{file_name}.validators.json"]:
+            Path(path).unlink(missing_ok=True)
+
+
+def test_download_file_to_tmp_without_validators(httpserver):
+    file_name = "deafrica-test-download-size.txt"
+    url = httpserver.url_for("/")
+    methods = []
+
+    def answer(request):
+        methods.append(request.method)
+        return Response(b"line\n" * 1000)
+
+    httpserver.expect_request(f"/{file_name}").respond_with_handler(answer)
+
+    try:
+        file_path = download_file_to_tmp(url, file_name)
+        assert methods == ["GET"]
+
+        # Without ETag or Last-Modified, the sizes are compared
+        assert download_file_to_tmp(url, file_name) == file_path
+        assert methods == ["GET", "HEAD"]
+
+        # A copy of a different size is downloaded again
+        file_path.write_bytes(b"line\n")
+        download_file_to_tmp(url, file_name)
+        assert methods == ["GET", "HEAD", "HEAD", "GET"]
+        assert file_path.read_bytes() == b"line\n" * 1000
+    finally:
+        for path in [f"/tmp/{file_name}", f"/tmp/{file_name}.validators.json"]:
+            Path(path).unlink(missing_ok=True)
+
+
+def test_open_file_download_stream(httpserver):
+    file_name = "deafrica-test-stream.txt"
+    url = httpserver.url_for("/")
+    httpserver.expect_request(f"/{file_name}").respond_with_data(b"line\n" * 1000)
+
+    try:
+        with open_file_download(url, file_name) as stream:
+            # The reader stops early, the copy on disk is still complete
+            assert stream.read(5) == b"line\n"
+        assert Path(f"/tmp/{file_name}").read_bytes() == b"line\n" * 1000
+
+        with pytest.raises(ValueError):
+            with open_file_download(url, file_name) as stream:
+                raise ValueError()
+        assert not Path(f"/tmp/{file_name}.part").exists()
+    finally:
+        for path in [f"/tmp/{file_name}", f"/tmp/{file_name}.validators.json"]:
+            Path(path).unlink(missing_ok=True)
+
+
+def test_get_reference_file(httpserver, tmp_path):
+    def answer(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return Response(status=304)
+        return Response(b"35PKS\n", headers={"ETag": '"v1"'})
+
+    httpserver.expect_request("/tiles.csv").respond_with_handler(answer)
+    url = httpserver.url_for("/tiles.csv")
+    cache_dir = str(tmp_path / "cache")
+
+    path = get_reference_file(url, cache_dir=cache_dir)
+    assert path.endswith(".csv")
+    assert Path(path).read_bytes() == b"35PKS\n"
+
+    # Fresh, no request is made
+    assert get_reference_file(url, cache_dir=cache_dir) == path
+    assert len(httpserver.log) == 1
+
+    # Expired, revalidated with its ETag
+    assert get_reference_file(url, cache_dir=cache_dir, ttl=0) == path
+    assert len(httpserver.log) == 2
+    assert httpserver.log[-1][1].status_code == 304
+
+    # A pre-seeded cache is used without any request
+    assert get_reference_file(url, cache_dir=str(tmp_path), seed_dir=cache_dir) == path
+    assert len(httpserver.log) == 2
+
+    # The cached copy is used when the server can not be reached
+    httpserver.stop()
+    try:
+        assert get_reference_file(url, cache_dir=cache_dir, ttl=0) == path
+    finally:
+        httpserver.start()
+
+
+def test_get_derived_reference(httpserver, tmp_path):
+    httpserver.expect_request("/extent.json").respond_with_data(b"[1, 2]")
+    url = httpserver.url_for("/extent.json")
+    builds = []
+
+    def build(path):
+        builds.append(path)
+        return sum(json.loads(Path(path).read_text()))
+
+    for _ in range(2):
+        assert (
+            get_derived_reference("total", [url], build, cache_dir=str(tmp_path)) == 3
+        )
+    assert len(builds) == 1
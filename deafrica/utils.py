@@ -1,10 +1,19 @@
 from __future__ import annotations
 
+import hashlib
+import io
+import json
 import logging
 import math
+import os
+import pickle
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
 from urllib.parse import urlparse
 
 import numpy as np
@@ -15,6 +24,19 @@ AFRICA_BBOX = [-26.36, 38.35, 64.50, -47.97]
 AFRICA_EXTENT_BBOX_URL = "https://raw.githubusercontent.com/digitalearthafrica/deafrica-extent/master/africa-extent-bbox.json"
 AFRICA_EXTENT_URL = "https://raw.githubusercontent.com/digitalearthafrica/deafrica-extent/refs/heads/master/africa-extent.json"
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Local cache of reference data, e.g. the Africa extent or tile lists, and
+# seconds a cached file is used before it is revalidated against its ETag
+REFERENCE_CACHE_DIR = os.getenv(
+    "DEAFRICA_REFERENCE_CACHE_DIR", "/tmp/deafrica-reference-cache"
+)
+REFERENCE_CACHE_TTL = int(os.getenv("DEAFRICA_REFERENCE_CACHE_TTL", "86400"))
+# Optional read-only cache with the same layout, e.g. baked into an image by
+# running with DEAFRICA_REFERENCE_CACHE_DIR pointing to it. Files found there
+# are used without any request.
+REFERENCE_SEED_DIR = os.getenv("DEAFRICA_REFERENCE_SEED_DIR")
+
 
 def send_slack_notification(url: str, title: str, message: str):
     """
@@ -68,6 +90,40 @@ def split_tasks(
     return task_chunks[worker_idx]
 
 
+def map_bounded(
+    func: Callable,
+    items: Iterable,
+    n_threads: int,
+    max_in_flight: int = None,
+) -> Iterator:
+    """
+    Apply func to every item using a pool of n_threads threads and yield the
+    results as they complete (not in input order).
+
+    Items are submitted lazily so that at most max_in_flight (default n_threads)
+    results are pending or waiting to be consumed at any time, which keeps
+    memory bounded for large inputs.
+
+    :param func: (Callable) function applied to each item
+    :param items: (Iterable) items to process
+    :param n_threads: (int) number of worker threads
+    :param max_in_flight: (int) maximum number of submitted but not yet yielded tasks
+    """
+    if n_threads < 1:
+        raise ValueError("n_threads needs to be greater than 0")
+
+    max_in_flight = max(max_in_flight or n_threads, 1)
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        pending = {executor.submit(func, item) for item in islice(items, max_in_flight)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+            for item in islice(items, len(done)):
+                pending.add(executor.submit(func, item))
+
+
 def convert_str_to_date(date: str):
     """
     Function to convert a date in a string format into a datetime YYYY/MM/DD.
@@ -91,16 +147,161 @@ def time_process(start: float):
     :return:
     """
     t_sec = round(time.time() - start)
-    (t_min, t_sec) = divmod(t_sec, 60)
-    (t_hour, t_min) = divmod(t_min, 60)
+    t_min, t_sec = divmod(t_sec, 60)
+    t_hour, t_min = divmod(t_min, 60)
 
     return f"{t_hour} hour: {t_min} min: {t_sec} sec"
 
 
+class DownloadStream(io.RawIOBase):
+    """
+    Readable binary stream over a streamed HTTP response, writing every chunk
+    read to a temporary file which replaces file_path once the whole body is read
+    """
+
+    def __init__(self, response: requests.Response, file_path: Path):
+        self.response = response
+        self.file_path = file_path
+        self.part_path = file_path.with_name(f"{file_path.name}.part")
+        self.part_file = self.part_path.open("wb")
+        self.chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        self.buffer = b""
+        self.completed = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.buffer and not self.completed:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                self.finish()
+            else:
+                self.part_file.write(self.buffer)
+
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def finish(self):
+        self.completed = True
+        self.part_file.close()
+        self.part_path.replace(self.file_path)
+        write_download_validators(self.file_path, self.response.headers)
+        logging.info(f"{self.file_path.name} Downloaded!")
+
+    def drain(self):
+        while self.read(DOWNLOAD_CHUNK_SIZE):
+            pass
+
+    def close(self):
+        if not self.closed:
+            self.response.close()
+            if not self.completed:
+                # Never leave a truncated file behind
+                self.part_file.close()
+                self.part_path.unlink(missing_ok=True)
+        super().close()
+
+
+def get_validators_path(file_path: Path) -> Path:
+    return file_path.with_name(f"{file_path.name}.validators.json")
+
+
+def read_download_validators(file_path: Path) -> dict:
+    """
+    Conditional request headers matching the saved copy of a downloaded file
+    """
+    validators_path = get_validators_path(file_path)
+    if not file_path.exists() or not validators_path.exists():
+        return {}
+    validators = json.loads(validators_path.read_text())
+    headers = {}
+    if validators.get("ETag"):
+        headers["If-None-Match"] = validators["ETag"]
+    if validators.get("Last-Modified"):
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+    return headers
+
+
+def write_download_validators(file_path: Path, headers) -> None:
+    get_validators_path(file_path).write_text(
+        json.dumps(
+            {
+                "ETag": headers.get("ETag"),
+                "Last-Modified": headers.get("Last-Modified"),
+            }
+        )
+    )
+
+
+def matches_server_size(url: str, file_path: Path) -> bool:
+    """
+    Compare the size of a local copy against the Content-Length of the server
+    file, for servers that send neither ETag nor Last-Modified
+    """
+    file_size = file_path.stat().st_size
+    head = requests.head(url)
+
+    if hasattr(head, "headers") and head.headers.get("Content-Length"):
+        server_file_size = head.headers["Content-Length"]
+        logging.info(
+            f"Comparing sizes between local saved file and server hosted file,"
+            f" local file size : {file_size} server file size: {server_file_size}"
+        )
+        return int(file_size) == int(server_file_size)
+    return False
+
+
+@contextmanager
+def open_file_download(url: str, file_name: str):
+    """
+    Open a file from the informed server as a binary stream, keeping a copy
+    under /tmp/. The copy is reused when the server answers the ETag or
+    Last-Modified of the previous download with 304 Not Modified, or, when the
+    server sent neither, when its size matches the server Content-Length.
+    Otherwise the body is read from the network while being written to disk,
+    so it can be parsed as it arrives.
+
+    :param url:(String) URL path for the file server
+    :param file_name: (String) File name which will be downloaded
+    :return: (BinaryIO) the file content, a DownloadStream when it is transferred
+    """
+    file_path = Path(f"/tmp/{file_name}")
+    file_url = urlparse(f"{url}{file_name}").geturl()
+    validators = read_download_validators(file_path)
+
+    response = None
+    if (
+        validators
+        or not file_path.exists()
+        or not matches_server_size(file_url, file_path)
+    ):
+        response = requests.get(file_url, headers=validators, stream=True)
+
+    if response is None or response.status_code == 304:
+        if response is not None:
+            response.close()
+        logging.info(f"File already found on {file_path}, Already updated!!")
+        with file_path.open("rb") as stream:
+            yield stream
+        return
+
+    response.raise_for_status()
+    logging.info(f"Downloading file {file_name} to {file_path}")
+    with DownloadStream(response, file_path) as stream:
+        yield stream
+        # Complete the copy on disk even if the reader stopped early
+        stream.drain()
+
+
 def download_file_to_tmp(url: str, file_name: str, always_return_path: bool = True):
     """
-    Function to check if a specific file is already downloaded based on its size,
-    if not downloaded, it will download the file from the informed server.
+    Function to check if a specific file is already downloaded based on its
+    ETag or Last-Modified date, or its size when the server sends neither, if
+    not downloaded, it will download the file from the informed server in chunks.
     The file will be saved in the local machine/container under the /tmp/ folder,
     so the OS will delete that accordingly with its pre-defined configurations.
     Warning: The server shall have enough free storage.
@@ -113,33 +314,146 @@ def download_file_to_tmp(url: str, file_name: str, always_return_path: bool = Tr
 
     logging.info("Start downloading files")
 
-    url = urlparse(f"{url}{file_name}")
+    with open_file_download(url=url, file_name=file_name) as stream:
+        downloaded = isinstance(stream, DownloadStream)
+
     file_path = Path(f"/tmp/{file_name}")
+    return file_path if downloaded or always_return_path else None
+
+
+def get_cache_entry_path(cache_dir: str, url: str) -> Path:
+    url_hash = hashlib.sha256(url.encode()).hexdigest()
+    return Path(cache_dir) / "urls" / f"{url_hash}.json"
+
 
-    # check if file exists and comparing size against cloud file
-    if file_path.exists():
-        logging.info(f"File already found on {file_path}")
+def read_cache_entry(cache_dir: str, url: str) -> dict | None:
+    """
+    Read the cache entry of a URL, None if it is missing or its content is gone
+    """
+    if not cache_dir:
+        return None
+    entry_path = get_cache_entry_path(cache_dir, url)
+    if not entry_path.exists():
+        return None
+    entry = json.loads(entry_path.read_text())
+    if not (Path(cache_dir) / entry["path"]).exists():
+        return None
+    return entry
+
+
+def write_cache_file(path: Path, data: bytes):
+    """
+    Write a file of the cache atomically, so concurrent readers never see a partial file
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
 
-        file_size = file_path.stat().st_size
-        head = requests.head(url.geturl())
 
-        if hasattr(head, "headers") and head.headers.get("Content-Length"):
-            server_file_size = head.headers["Content-Length"]
-            logging.info(
-                f"Comparing sizes between local saved file and server hosted file,"
-                f" local file size : {file_size} server file size: {server_file_size}"
-            )
+def get_reference_file(
+    url: str, cache_dir: str = None, ttl: int = None, seed_dir: str = None
+) -> str:
+    """
+    Function to get a local copy of a reference file, downloading it only when needed.
+    Files are stored by the SHA-256 of their content and each URL points to the
+    content it served, with its ETag and Last-Modified. A file younger than ttl is
+    used as is, an older one is revalidated with a conditional request and only
+    downloaded again if it changed. When the server can not be reached the cached
+    file is used whatever its age.
+
+    :param url:(String) URL of the reference file
+    :param cache_dir:(String) cache folder, defaults to REFERENCE_CACHE_DIR
+    :param ttl:(int) seconds a cached file is used without revalidation, defaults to REFERENCE_CACHE_TTL
+    :param seed_dir:(String) read-only pre-seeded cache, defaults to REFERENCE_SEED_DIR
+    :return: (String) local path of the reference file
+    """
+    cache_dir = cache_dir or REFERENCE_CACHE_DIR
+    ttl = REFERENCE_CACHE_TTL if ttl is None else ttl
+    seed_dir = seed_dir or REFERENCE_SEED_DIR
 
-            if int(file_size) == int(server_file_size):
-                logging.info("Already updated!!")
-                return file_path if always_return_path else None
+    seeded = read_cache_entry(seed_dir, url)
+    if seeded is not None:
+        return str(Path(seed_dir) / seeded["path"])
 
-    logging.info(f"Downloading file {file_name} to {file_path}")
-    downloaded = requests.get(url.geturl(), stream=True)
-    file_path.write_bytes(downloaded.content)
+    entry = read_cache_entry(cache_dir, url)
+    if entry is not None and time.time() - entry["fetched"] < ttl:
+        return str(Path(cache_dir) / entry["path"])
 
-    logging.info(f"{file_name} Downloaded!")
-    return file_path
+    headers = {}
+    if entry is not None and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry is not None and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        response = requests.get(url, headers=headers, timeout=60)
+        if response.status_code != 304:
+            response.raise_for_status()
+    except requests.RequestException as error:
+        if entry is None:
+            raise
+        logging.warning(f"Using the cached {url}, it could not be checked: {error}")
+        return str(Path(cache_dir) / entry["path"])
+
+    if response.status_code != 304:
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        # Keep the extensions so readers can tell the format of the file
+        suffixes = "".join(Path(urlparse(url).path).suffixes)
+        content_path = Path(cache_dir) / "content" / f"{content_hash}{suffixes}"
+        if not content_path.exists():
+            write_cache_file(content_path, response.content)
+        entry = {
+            "url": url,
+            "path": str(content_path.relative_to(cache_dir)),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        logging.info(f"Cached {url} in {content_path}")
+
+    entry["fetched"] = time.time()
+    write_cache_file(get_cache_entry_path(cache_dir, url), json.dumps(entry).encode())
+    return str(Path(cache_dir) / entry["path"])
+
+
+def get_derived_reference(
+    name: str,
+    urls: list[str],
+    build: Callable[..., Any],
+    cache_dir: str = None,
+    seed_dir: str = None,
+) -> Any:
+    """
+    Function to get an artefact computed from reference files, such as the tiles
+    of a GridSpec over the Africa extent. It is only built again when one of the
+    reference files changed.
+
+    :param name:(String) name of the artefact, including the parameters it depends on
+    :param urls:(List(String)) URLs of the reference files it is built from
+    :param build:(Callable) builds the picklable artefact from the local paths of the reference files, in the order of urls
+    :param cache_dir:(String) cache folder, defaults to REFERENCE_CACHE_DIR
+    :param seed_dir:(String) read-only pre-seeded cache, defaults to REFERENCE_SEED_DIR
+    :return: the artefact
+    """
+    cache_dir = cache_dir or REFERENCE_CACHE_DIR
+    seed_dir = seed_dir or REFERENCE_SEED_DIR
+
+    paths = [
+        get_reference_file(url, cache_dir=cache_dir, seed_dir=seed_dir) for url in urls
+    ]
+    # Reference files are named by their content hash
+    key = hashlib.sha256(
+        "\n".join([name] + [Path(path).name for path in paths]).encode()
+    ).hexdigest()
+
+    for folder in [seed_dir, cache_dir]:
+        artefact_path = Path(folder or "") / "derived" / f"{key}.pkl"
+        if folder and artefact_path.exists():
+            return pickle.loads(artefact_path.read_bytes())
+
+    artefact = build(*paths)
+    write_cache_file(Path(cache_dir) / "derived" / f"{key}.pkl", pickle.dumps(artefact))
+    return artefact
 
 
 def test_http_return(returned):
@@ -5,14 +5,14 @@ E.g command: python generate_report.py "s3://deafrica-sentinel-2-inventory/deafr
 
 """
 
-import json
-from pathlib import Path
-
-import boto3
 import click
 import pandas as pd
+import pyarrow.compute as pc
+from odc.aws import s3_client
 from tqdm import tqdm
 
+from deafrica.inventory import list_inventory_batches
+
 MANIFEST_SUFFIX = "manifest.json"
 SRC_BUCKET_NAME = "deafrica-sentinel-2"
 INVENTORY_BUCKET_NAME = "s3://deafrica-sentinel-2-inventory/"
@@ -26,42 +26,31 @@ def generate_report(manifest_file, output_filepath):
     Compare Sentinel-2 buckets in US and Africa and detect differences
     A report containing missing keys will be written to output folder
     """
-    s3 = boto3.client("s3", region_name="af-south-1")
-    manifest_file = manifest_file
-
-    def read_manifest():
-        bucket, key = manifest_file.replace("s3://", "").split("/", 1)
-        s3_clientobj = s3.get_object(Bucket=bucket, Key=key)
-        return json.loads(s3_clientobj["Body"].read().decode("utf-8"))
-
-    manifest = read_manifest()
-    df = pd.Series()
-
-    for obj in tqdm(manifest["files"]):
-        bucket = "deafrica-sentinel-2-inventory"
-        gzip_obj = s3.get_object(Bucket=bucket, Key=obj["key"])
-        inventory_df = pd.read_csv(
-            gzip_obj["Body"],
-            names=["bucket", "key", "size", "time"],
-            compression="gzip",
-            header=None,
+    s3 = s3_client(region_name="af-south-1", max_pool_connections=20)
+
+    df = pd.Series(dtype="int64")
+    for batch in tqdm(
+        list_inventory_batches(manifest_file, s3=s3, columns=["Key"], n_threads=20)
+    ):
+        # count objects per scene folder
+        folders = pc.replace_substring_regex(
+            batch.column("Key"), pattern="/[^/]*$", replacement=""
+        )
+        counts = pc.value_counts(folders)
+        df = df.add(
+            pd.Series(
+                counts.field("counts").to_numpy(),
+                index=counts.field("values").to_pylist(),
+            ),
+            fill_value=0,
         )
-        # second column is the object key
-        inventory_df["key"] = inventory_df["key"].map(lambda a: Path(a).parent)
-        count = inventory_df.groupby("key").count()["size"]
-        partial_inventory = count[count != 18]
-        df = df.append(partial_inventory)
-        # aggregate across files
-        df = df.groupby(df.index).sum()
-        df = df[df != 18]
+
+    df = df[df != 18]
 
     print(f"{len(df)} partial scenes found in {SRC_BUCKET_NAME}")
 
     output_file = open(output_filepath, "w")
-    df.index = [
-        "s3://sentinel-cogs/" + str(x) + "/" + x.name + ".json" for x in df.index
-    ]
-    df.index = df.index.astype(str)
+    df.index = [f"s3://sentinel-cogs/{x}/{x.rsplit('/', 1)[-1]}.json" for x in df.index]
     output_file.write("\n".join(df.index))
 
 
@@ -2,7 +2,9 @@ import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
-from odc.aws import inventory, s3_head_object
+from odc.aws import s3_head_object
+
+from deafrica import inventory
 
 os.environ["AWS_ACCESS_KEY_ID"] = ""
 os.environ["AWS_SECRET_ACCESS_KEY"] = ""
@@ -20,20 +22,22 @@ def double_slash_report():
         aws_unsigned=True,
         use_ssl=True,
         cache=False,
+        max_pool_connections=200,
     )
     manifest = inventory.find_latest_manifest(
         prefix="s3://deafrica-landsat-inventory/deafrica-landsat/deafrica-landsat-inventory/",
         s3=s3,
     )
-    inventory_list = inventory.list_inventory(
+    batches = inventory.list_inventory_batches(
         manifest=manifest,
         s3=s3,
+        contains="//",
+        columns=["Key"],
         n_threads=200,
     )
 
-    for namespace in inventory_list:
-        if hasattr(namespace, "Key") and "//" in namespace.Key:
-            yield namespace.Key
+    for batch in batches:
+        yield from batch.column("Key").to_pylist()
 
 
 def create_txt(path_list, file_name):